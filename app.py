@@ -6,77 +6,393 @@
 import random
 import string
 import json
+import hashlib
+import os
+import signal
+from collections import defaultdict, namedtuple
+from datetime import timezone
+from functools import wraps
 
 from flask import Flask, render_template, abort, redirect, url_for, request
 from flask import session as login_session, make_response, flash, jsonify
-from sqlalchemy import create_engine, desc
-from sqlalchemy.orm import sessionmaker
+from flask import stream_with_context, g
+from sqlalchemy import desc, event
+from sqlalchemy.orm import scoped_session
 from oauth2client import client
-import httplib2
-import requests
+from werkzeug.wsgi import wrap_file
+
+import config
+import export
+import snapshots
+from assets import AssetManifest
+from category_cache import CategoryCache
+from compression import Compression, encoded_etag, etag_variants
+from provider_config import ProviderConfig
+from provider_http import ProviderHTTPClient
+from google_id_token import GoogleKeySet, IDTokenError, verify_id_token
+from instrumentation import Instrumentation, timed
+from provider_config import load_google_config, load_facebook_config
+from response_cache import create_response_cache
+from search import parse_terms, search
+from storage import get_engines, create_session_factory
+from database_setup import Base, User, Category, Item, CatalogState
+from database_setup import make_slug, bump_catalog_version
+from database_setup import bump_category_versions
+
+# Connect to the database (reading through a pool of connections that can be
+# shared by several threads, and writing through a single writer connection)
+# and bind the writer engine to the Base class.
+engines = get_engines()
+Base.metadata.bind = engines.writer
+
+# Create a session registry. Each thread (and therefore each request) gets its
+# own session, which is removed once the request has been handled.
+DBSession = create_session_factory(engines)
+session = scoped_session(DBSession)
+
+# Cache the categories (used to build every page's navigation) in memory
+category_cache = CategoryCache(session, ttl=config.CATEGORY_CACHE_TTL)
+category_cache.invalidate_on_change()
+
+# Cache the pages rendered for anonymous visitors (if enabled)
+page_cache = create_response_cache(
+    config.PAGE_CACHE_BACKEND, config.PAGE_CACHE_MAX_ENTRIES,
+    config.PAGE_CACHE_DIR)
+
+# Load the authentication providers' client secrets
+google_config = ProviderConfig(
+    config.GOOGLE_CLIENT_SECRET_FILE, load_google_config)
+facebook_config = ProviderConfig(
+    config.FACEBOOK_CLIENT_SECRET_FILE, load_facebook_config)
+
+
+# Make every call to the providers' APIs through one pooled HTTP client
+provider_http = ProviderHTTPClient(
+    pool_size=config.PROVIDER_HTTP_POOL_SIZE,
+    connect_timeout=config.PROVIDER_HTTP_CONNECT_TIMEOUT,
+    read_timeout=config.PROVIDER_HTTP_READ_TIMEOUT,
+    retries=config.PROVIDER_HTTP_RETRIES,
+    backoff_factor=config.PROVIDER_HTTP_BACKOFF_FACTOR,
+    workers=config.PROVIDER_HTTP_WORKERS)
+
+# Cache Google's ID token signing keys (used when verifying ID tokens locally)
+google_key_set = GoogleKeySet(
+    provider_http, lambda: config.GOOGLE_API_URL + '/oauth2/v3/certs',
+    keys_file=config.GOOGLE_JWKS_FILE)
+
+
+# Reload the client secrets when the process receives a SIGHUP signal (they're
+# also reloaded whenever one of the files is modified).
+def reload_provider_configs(signum, frame):
+    google_config.reload()
+    facebook_config.reload()
+
+try:
+    signal.signal(signal.SIGHUP, reload_provider_configs)
+except (AttributeError, ValueError):
+    # SIGHUP isn't available on this platform, or the app isn't being loaded
+    # from the main thread.
+    pass
 
-from database_setup import Base, User, Category, Item
+# Assign an instance of the Flask class to the app variable
+app = Flask(__name__)
 
-# Connect to the database and bind the engine to the Base class
-engine = create_engine('sqlite:///catalog.db')
-Base.metadata.bind = engine
+# Compress responses (and send static files from their precompressed copies)
+if config.COMPRESSION:
+    compression = Compression(
+        app, min_size=config.COMPRESSION_MIN_SIZE,
+        gzip_level=config.COMPRESSION_GZIP_LEVEL,
+        brotli_quality=config.COMPRESSION_BROTLI_QUALITY)
 
-# Create a session
-DBSession = sessionmaker(bind=engine)
-session = DBSession()
+# Fingerprint the static files' URLs, so browsers can cache them for good
+if config.ASSET_FINGERPRINTS:
+    asset_manifest = AssetManifest(app, max_age=config.ASSET_MAX_AGE)
 
-# Assign an instance of the Flask class to the app variable
-app = Flask(__name__)
+# Instrument requests, timing the SQL statements, templates, and calls to the
+# providers behind each one (if enabled).
+if config.INSTRUMENTATION:
+    instrumentation = Instrumentation(app)
+    instrumentation.instrument_client(provider_http)
 
 
-# Close the session after each request
+# Remove the request's session (returning its connection to the pool) after
+# each request.
 @app.teardown_appcontext
 def shutdown_session(exception=None):
-    session.close()
+    session.remove()
+
+
+def conditional(exists=None):
+    """Decorates a JSON API view so its responses carry an ETag and a
+    Last-Modified header (both based on the catalog's version). Conditional
+    requests that match the current version get a 304 Not Modified response
+    without running the view. If the view can return a 404 error, exists is
+    called with the view's arguments first, so that a 304 response is only
+    sent for data that exists."""
+
+    def decorator(view):
+        @wraps(view)
+        def decorated_view(*args, **kwargs):
+            # Get the catalog's current version (without which there's
+            # nothing to base the headers on). The ETag also covers the
+            # request path and arguments, since each URL returns different
+            # data.
+            state = session.query(CatalogState).get(1)
+            if state is None:
+                return view(*args, **kwargs)
+
+            # Keep the version for the view (so it needn't query it again)
+            g.catalog_version = state.version
+            etag = hashlib.sha1('{}:{}'.format(
+                state.version, request.full_path).encode('utf-8')).hexdigest()
+            modified = state.modified.replace(
+                microsecond=0, tzinfo=timezone.utc)
+
+            # If the client's copy (compressed or not) is still current, tell
+            # it so (unless its copy is compressed with an encoding it would
+            # no longer be sent)
+            if request.if_none_match:
+                current = [
+                    variant for variant in etag_variants(
+                        etag, request.accept_encodings)
+                    if request.if_none_match.contains(variant)]
+                not_modified = bool(current)
+            else:
+                current = [etag]
+                not_modified = (
+                    request.if_modified_since is not None and
+                    modified <= request.if_modified_since)
+            if not_modified and exists is not None and not exists(**kwargs):
+                abort(404)
+            if not_modified:
+                response = make_response('', 304)
+                response.set_etag(current[0])
+            else:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+                response.set_etag(
+                    encoded_etag(etag, response.content_encoding))
+            response.last_modified = modified
+            return response
+
+        return decorated_view
+
+    return decorator
+
+
+def category_exists(category_arg, **kwargs):
+    """Returns whether there's a category with the supplied name (checked
+    through the category cache, so without querying the database)."""
+    return category_cache.get_id(category_arg) is not None
+
+
+# Once changes to the catalog have been committed, invalidate the cached pages
+# that showed the changed data.
+@event.listens_for(DBSession, 'after_commit')
+def invalidate_cached_pages(db_session):
+    tags = db_session.info.pop('changed_pages', None)
+    if tags and page_cache is not None:
+        page_cache.invalidate(tags)
+
+
+# If the changes are rolled back instead, forget about them
+@event.listens_for(DBSession, 'after_rollback')
+def forget_changed_pages(db_session):
+    db_session.info.pop('changed_pages', None)
+
+
+# Categories appear in every page's navigation, so a change to any category
+# invalidates every cached page.
+@event.listens_for(Category, 'after_insert')
+@event.listens_for(Category, 'after_update')
+@event.listens_for(Category, 'after_delete')
+def category_changed(mapper, connection, target):
+    if page_cache is not None:
+        page_cache.invalidate(['all'])
+
+
+def cached_page(*tags):
+    """Decorates a page view so that anonymous visitors are served a cached
+    copy of the page (when page caching is enabled). The tags name the parts
+    of the catalog shown on the page, and are formatted with the view's
+    arguments. Whenever one of those parts changes, the page is re-rendered.
+    """
+
+    def decorator(view):
+        @wraps(view)
+        def decorated_view(**kwargs):
+            # Logged in users (and visitors with a pending flash message) are
+            # shown personalized pages, so render those as usual.
+            if (page_cache is None or 'username' in login_session or
+                    '_flashes' in login_session):
+                return view(**kwargs)
+
+            # Serve the cached page (if there's a current copy)
+            key = request.full_path
+            cached = page_cache.get(key)
+            if cached is not None:
+                body, mimetype = cached
+                return app.response_class(body, mimetype=mimetype)
+
+            # Otherwise render the page and cache it. The tag versions are
+            # read first, so a change made while the page is being rendered
+            # invalidates it.
+            tag_versions = page_cache.tag_versions(
+                ['all'] + [tag.format(**kwargs) for tag in tags])
+            response = make_response(view(**kwargs))
+            if response.status_code == 200:
+                page_cache.set(
+                    key, tag_versions, response.get_data(), response.mimetype)
+            return response
+
+        return decorated_view
+
+    return decorator
+
+
+def send_snapshot(name, version):
+    """Returns a response that sends the snapshot (see snapshots.py) of the
+    supplied version, compressed if the client accepts it. Returns None if
+    there's no such snapshot, in which case the data has to be queried."""
+    if not config.SNAPSHOT_DIR:
+        return None
+    snapshot = snapshots.find_snapshot(
+        os.path.abspath(config.SNAPSHOT_DIR), name, version,
+        request.accept_encodings)
+    if snapshot is None:
+        return None
+    path, encoding = snapshot
+
+    # Send the file (using the server's sendfile support, if it has any).
+    # Unlike send_file(), this adds no headers of its own (and doesn't answer
+    # range requests), so the response has the same headers as one built
+    # from the database.
+    snapshot_file = open(path, 'rb')
+    response = app.response_class(
+        wrap_file(request.environ, snapshot_file),
+        mimetype='application/json', direct_passthrough=True)
+    response.content_length = os.fstat(snapshot_file.fileno()).st_size
+    if encoding is not None:
+        response.content_encoding = encoding
+    response.vary.add('Accept-Encoding')
+    return response
+
+
+def stream_export(pieces, mimetype):
+    """Returns a response that streams an export's pieces to the client (in
+    chunks), keeping the request's session open until it's finished."""
+    return app.response_class(
+        stream_with_context(export.buffered(pieces, config.EXPORT_CHUNK_SIZE)),
+        mimetype=mimetype)
 
 
-# API endpoint that returns JSONified catalog data
+# API endpoint that returns JSONified catalog data. The current snapshot is
+# sent if there is one. Otherwise, with the 'stream' argument, the data is
+# streamed as it's read from the database instead of being built in memory
+# first.
 @app.route('/api/catalog')
+@conditional()
 def catalog_json():
+    # (the catalog's version is looked up by conditional(), unless there's no
+    # catalog state yet)
+    version = g.get('catalog_version')
+    if version is not None:
+        response = send_snapshot(snapshots.CATALOG_NAME, version)
+        if response is not None:
+            return response
+
+    if request.args.get('stream', type=int):
+        return stream_export(
+            export.catalog_json(
+                session, snapshots.dumps, config.EXPORT_BATCH_SIZE),
+            'application/json')
+
     # Get the categories
     categories = session.query(Category).all()
 
-    # Get the items
-    items = session.query(Item).all()
+    # Group the items by category ID in a single pass, so that each category
+    # only has to serialize its own items (rather than scanning all of them).
+    items_by_category = defaultdict(list)
+    for item in session.query(Item).order_by(Item.id):
+        items_by_category[item.cat_id].append(item)
 
     # Return the JSONified data
-    return jsonify(
-        categories=[category.serialize(items) for category in categories])
+    return jsonify(categories=[
+        category.serialize(items_by_category[category.id])
+        for category in categories])
+
+
+# API endpoint that streams the catalog as newline-delimited JSON (a line for
+# each category, followed by a line for each of its items)
+@app.route('/api/catalog.ndjson')
+@conditional()
+def catalog_ndjson():
+    return stream_export(
+        export.catalog_ndjson(
+            session, snapshots.dumps, config.EXPORT_BATCH_SIZE),
+        'application/x-ndjson')
 
 
 # API endpoint that returns JSONified category data (if the category exists)
 @app.route('/api/catalog/<category_arg>')
+@conditional(exists=category_exists)
 def category_json(category_arg):
     # Try getting the category
-    category = (
-        session.query(Category)
-        .filter(Category.name.ilike(category_arg)).first())
+    category_id = category_cache.get_id(category_arg)
 
     # If the category doesn't exist, send a 404 error code
-    if category is None:
+    if category_id is None:
         abort(404)
+    category = session.query(Category).get(category_id)
+
+    # If a page of items was requested, return just that page (newest first)
+    # along with links to the neighbouring pages.
+    if 'before' in request.args or 'limit' in request.args:
+        page_size = request.args.get('limit', config.API_PAGE_SIZE, type=int)
+        page_size = max(1, min(page_size, config.API_MAX_PAGE_SIZE))
+        page = get_listing_page(
+            session.query(Item).filter_by(cat_id=category_id), page_size)
+
+        next_url = prev_url = None
+        if page.next_before is not None:
+            next_url = page_url(page.next_before, limit=page_size)
+        if page.has_prev:
+            prev_url = page_url(page.prev_before, limit=page_size)
+        return jsonify(
+            category=category.serialize(page.items), next=next_url,
+            prev=prev_url)
+
+    # Otherwise send the category's current snapshot, if there is one
+    response = send_snapshot(
+        snapshots.category_name(category.id), category.version)
+    if response is not None:
+        return response
 
-    # Get the items
-    items = session.query(Item).all()
+    # Or get all of the category's items (using the index on the category
+    # ID)
+    items = (
+        session.query(Item).filter_by(cat_id=category_id)
+        .order_by(Item.id).all())
 
     # Return the JSONified data
     return jsonify(category=category.serialize(items))
 
 
 # API endpoint that returns JSONified item data (if the item exists under the
-# supplied category).
+# supplied category). Only the category is checked before a 304 response: an
+# item's URL only gets an ETag when the item exists, and an ETag that still
+# matches means nothing has changed since.
 @app.route('/api/catalog/<category_arg>/<item_arg>')
+@conditional(exists=category_exists)
 def item_json(category_arg, item_arg):
+    # Try getting the category ID
+    category_id = category_cache.get_id(category_arg)
+
     # Try getting the item
-    item = (
-        session.query(Item)
-        .filter(Category.name.ilike(category_arg), Item.name.ilike(item_arg))
-        .first())
+    item = None
+    if category_id is not None:
+        item = find_item(category_id, item_arg)
 
     # If the item doesn't exist (at least under the supplied category), send a
     # 404 error code.
@@ -87,11 +403,37 @@ def item_json(category_arg, item_arg):
     return jsonify(item=item.serialize())
 
 
+# API endpoint that returns JSONified search results (best matches first),
+# a page at a time.
+@app.route('/api/search')
+@conditional()
+def search_json():
+    page_size = request.args.get('limit', config.API_PAGE_SIZE, type=int)
+    page_size = max(1, min(page_size, config.API_MAX_PAGE_SIZE))
+    query = request.args.get('q', '')
+    page = get_search_page(session.query(Item), query, page_size)
+
+    # Link to the neighbouring pages (if there are any)
+    next_url = prev_url = None
+    if page.has_next:
+        next_url = url_for(
+            'search_json', q=query, page=page.number + 1, limit=page_size)
+    if page.number > 1:
+        prev_url = url_for(
+            'search_json', q=query, page=page.number - 1, limit=page_size)
+
+    # Return the JSONified data (noting whether only some of the matches were
+    # ranked)
+    return jsonify(
+        items=[item.serialize() for item in page.items], next=next_url,
+        prev=prev_url, truncated=page.truncated)
+
+
 # Show the privacy policy
 @app.route('/privacy-policy')
 def privacy_policy():
     # Get the categories
-    categories = session.query(Category).all()
+    categories = category_cache.all()
 
     # Show the page
     return render_template('privacy_policy.html', categories=categories)
@@ -106,7 +448,7 @@ def show_login():
         return redirect(url_for('index'))
 
     # Get the categories
-    categories = session.query(Category).all()
+    categories = category_cache.all()
 
     # Create a state token using random letters and numbers
     state = ''.join(random.choice(string.ascii_uppercase + string.digits)
@@ -141,14 +483,18 @@ def gconnect():
     # Try exchanging the authorization code for an access token, refresh
     # token, and ID token (all contained in a credentials object).
     try:
-        # First locate the application client secret file
-        CLIENT_SECRET_FILE = 'client_secret.json'
+        # First get the application's client secrets
+        google = google_config.get()
 
         # Now make the exchange to get the credentials object
-        credentials = client.credentials_from_clientsecrets_and_code(
-            CLIENT_SECRET_FILE,
-            ['profile', 'email'],
-            auth_code)
+        with timed('provider'):
+            credentials = client.credentials_from_code(
+                google.client_id,
+                google.client_secret,
+                ['profile', 'email'],
+                auth_code,
+                auth_uri=google.auth_uri,
+                token_uri=google.token_uri)
 
     # If there's a problem obtaining the credentials, send a response with a
     # 401 error code.
@@ -160,55 +506,66 @@ def gconnect():
         response.headers['Content-Type'] = 'application/json'
         return response
 
-    # Try verifying that the access token is valid
-    try:
-        access_token = credentials.access_token
-        url = (
-            'https://www.googleapis.com/oauth2/v3/tokeninfo?access_token={}'
-            .format(access_token))
-        h = httplib2.Http()
-
-        # In order to use json.loads(), it was necessary to add the .decode()
-        # method. The following Stack Overflow post was helpful in finding this
-        # solution: https://stackoverflow.com/q/42683478
-        result = json.loads(h.request(url, 'GET')[1].decode('utf-8'))
-
-    # If there's a problem trying to verify the access token, send a response
-    # with a 500 error code.
-    except:
-        print('Failed to verify access token')
-        response = make_response(json.dumps(
-            'Failed to verify access token'), 500)
-        response.headers['Content-Type'] = 'application/json'
-        return response
+    # If ID tokens are verified locally, check the ID token's signature,
+    # audience, issuer, and expiry here (using Google's cached signing keys),
+    # and take the user's info from the token's claims.
+    user_data = None
+    if config.GOOGLE_ID_TOKEN_VERIFICATION == 'local':
+        try:
+            user_data = verify_id_token(
+                credentials.token_response['id_token'], google.client_id,
+                google_key_set)
+            g_user_id = user_data['sub']
+
+        # If the ID token can't be verified, send a 401 error code
+        except (IDTokenError, KeyError, TypeError) as e:
+            print('Failed to verify ID token ({})'.format(e))
+            response = make_response(json.dumps(
+                'Failed to verify ID token'), 401)
+            response.headers['Content-Type'] = 'application/json'
+            return response
 
-    # If there was an error validating the access token, send a 500 error code
-    if result.get('error_description')is not None:
-        print(result.get('error_description'))
-        response = make_response(json.dumps(
-            result.get('error_description')), 500)
-        response.headers['Content-Type'] = 'application/json'
-        return response
+    # Otherwise ask Google to verify the access token
+    else:
+        # Try verifying that the access token is valid
+        try:
+            url = config.GOOGLE_API_URL + '/oauth2/v3/tokeninfo'
+            params = {'access_token': credentials.access_token}
+            result = provider_http.get_json(url, params=params)
+
+        # If there's a problem trying to verify the access token, send a
+        # response with a 500 error code.
+        except:
+            print('Failed to verify access token')
+            response = make_response(json.dumps(
+                'Failed to verify access token'), 500)
+            response.headers['Content-Type'] = 'application/json'
+            return response
 
-    # Make sure the access token is for the intended user
-    g_user_id = credentials.id_token['sub']
-    if result.get('sub') != g_user_id:
-        print('User ID mismatch')
-        response = make_response(json.dumps('User ID mismatch'), 401)
-        response.headers['Content-Type'] = 'application/json'
-        return response
+        # If there was an error validating the access token, send a 500 error
+        # code.
+        if result.get('error_description')is not None:
+            print(result.get('error_description'))
+            response = make_response(json.dumps(
+                result.get('error_description')), 500)
+            response.headers['Content-Type'] = 'application/json'
+            return response
 
-    # Get the client ID from the application client secret file
-    CLIENT_ID = json.loads(
-        open(CLIENT_SECRET_FILE, 'r').read())['web']['client_id']
+        # Make sure the access token is for the intended user
+        g_user_id = credentials.id_token['sub']
+        if result.get('sub') != g_user_id:
+            print('User ID mismatch')
+            response = make_response(json.dumps('User ID mismatch'), 401)
+            response.headers['Content-Type'] = 'application/json'
+            return response
 
-    # We'll use the client ID to make sure the access token is valid for this
-    # application.
-    if result.get('azp') != CLIENT_ID:
-        print('Client ID mismatch')
-        response = make_response(json.dumps('Client ID mismatch'), 401)
-        response.headers['Content-Type'] = 'application/json'
-        return response
+        # We'll use the client ID to make sure the access token is valid for
+        # this application.
+        if result.get('azp') != google.client_id:
+            print('Client ID mismatch')
+            response = make_response(json.dumps('Client ID mismatch'), 401)
+            response.headers['Content-Type'] = 'application/json'
+            return response
 
     # Now check if the user is already logged in
     stored_access_token = login_session.get('access_token')
@@ -220,37 +577,43 @@ def gconnect():
         flash('You are already logged in!')
         return response
 
-    # Try getting user info from Google
-    try:
-        url = 'https://www.googleapis.com/oauth2/v3/userinfo'
-        params = {'access_token': credentials.access_token, 'alt': 'json'}
-        r = requests.get(url, params=params)
-        user_data = r.json()
-
-    # If there's a problem trying to get user info, send a response with a 500
-    # error code.
-    except:
-        print('Failed to get user info')
-        response = make_response(json.dumps('Failed to get user info'), 500)
-        response.headers['Content-Type'] = 'application/json'
-        return response
+    # Try getting user info from Google (unless it came from the ID token)
+    if user_data is None:
+        try:
+            url = config.GOOGLE_API_URL + '/oauth2/v3/userinfo'
+            params = {'access_token': credentials.access_token, 'alt': 'json'}
+            user_data = provider_http.get_json(url, params=params)
+
+        # If there's a problem trying to get user info, send a response with a
+        # 500 error code.
+        except:
+            print('Failed to get user info')
+            response = make_response(
+                json.dumps('Failed to get user info'), 500)
+            response.headers['Content-Type'] = 'application/json'
+            return response
 
-    # If the request for user info is denied by Google, send a 500 error code
-    if user_data.get('error_description')is not None:
-        print(user_data.get('error_description'))
-        response = make_response(json.dumps(
-            user_data.get('error_description')), 500)
-        response.headers['Content-Type'] = 'application/json'
-        return response
+        # If the request for user info is denied by Google, send a 500 error
+        # code.
+        if user_data.get('error_description')is not None:
+            print(user_data.get('error_description'))
+            response = make_response(json.dumps(
+                user_data.get('error_description')), 500)
+            response.headers['Content-Type'] = 'application/json'
+            return response
 
     # Store the access token and Google user ID
     login_session['access_token'] = credentials.access_token
     login_session['g_user_id'] = g_user_id
 
     # Store user info in the login_session object
-    login_session['username'] = user_data['given_name']
+    # (ID tokens only include the name and picture claims if the profile
+    # scope was granted)
     login_session['email'] = user_data['email']
-    login_session['picture'] = user_data['picture']
+    login_session['username'] = (
+        user_data.get('given_name') or user_data.get('name') or
+        login_session['email'].split('@')[0])
+    login_session['picture'] = user_data.get('picture', '')
     login_session['provider'] = 'google'
 
     # Check if the user is already in the database. If not, add them.
@@ -290,20 +653,16 @@ def fbconnect():
 
     # Try exchanging the access token for a long-lived server-side token
     try:
-        # First locate the application client secret file
-        CLIENT_SECRET_FILE = 'fb_client_secret.json'
-
-        # Get the app ID and app secret from the client secret file
-        APP_ID = json.loads(
-            open(CLIENT_SECRET_FILE, 'r').read())['web']['app_id']
-        APP_SECRET = json.loads(
-            open(CLIENT_SECRET_FILE, 'r').read())['web']['app_secret']
-        url = (
-            'https://graph.facebook.com/oauth/access_token?grant_type='
-            'fb_exchange_token&client_id={}&client_secret={}&'
-            'fb_exchange_token={}'.format(APP_ID, APP_SECRET, access_token))
-        h = httplib2.Http()
-        result = json.loads(h.request(url, 'GET')[1].decode('utf-8'))
+        # First get the app ID and app secret
+        facebook = facebook_config.get()
+        url = config.FACEBOOK_GRAPH_URL + '/oauth/access_token'
+        params = {
+            'grant_type': 'fb_exchange_token',
+            'client_id': facebook.app_id,
+            'client_secret': facebook.app_secret,
+            'fb_exchange_token': access_token
+        }
+        result = provider_http.get_json(url, params=params)
 
     # If there's a problem obtaining the long-lived token, send a response
     # with a 401 error code.
@@ -334,16 +693,23 @@ def fbconnect():
         flash('You are already logged in!')
         return response
 
-    # Try getting user info from Facebook
-    try:
-        url = 'https://graph.facebook.com/me'
-        params = {'fields': 'id,first_name,email', 'access_token': token}
-        r = requests.get(url, params=params)
-        user_data = r.json()
+    # Get the user's info and profile picture from Facebook. Both requests only
+    # need the long-lived token, so they're made at the same time.
+    user_data, picture_data = provider_http.get_json_concurrently(
+        (config.FACEBOOK_GRAPH_URL + '/me', {
+            'fields': 'id,first_name,email',
+            'access_token': token
+        }),
+        (config.FACEBOOK_GRAPH_URL + '/me/picture', {
+            'redirect': 'false',
+            'width': '200',
+            'height': '200',
+            'access_token': token
+        }))
 
     # If there's a problem trying to get user info, send a response with a 500
     # error code.
-    except:
+    if isinstance(user_data, Exception):
         print('Failed to get user info')
         response = make_response(json.dumps('Failed to get user info'), 500)
         response.headers['Content-Type'] = 'application/json'
@@ -357,21 +723,9 @@ def fbconnect():
         response.headers['Content-Type'] = 'application/json'
         return response
 
-    # Try getting the user's profile picture
-    try:
-        url = 'https://graph.facebook.com/me/picture'
-        params = {
-            'redirect': 'false',
-            'width': '200',
-            'height': '200',
-            'access_token': token
-        }
-        r = requests.get(url, params=params)
-        picture_data = r.json()
-
     # If there's a problem trying to get the picture, send a response with a
     # 500 error code.
-    except:
+    if isinstance(picture_data, Exception):
         print('Failed to get user picture')
         response = make_response(json.dumps('Failed to get user picture'), 500)
         response.headers['Content-Type'] = 'application/json'
@@ -483,24 +837,35 @@ def delete_account():
             response.headers['Content-Type'] = 'application/json'
             return response
 
-        # Get the items added by the user
-        user_items = session.query(Item).filter_by(user=user).all()
-
-        # Delete each of the user's items from the database
-        for item in user_items:
-            session.delete(item)
+        # Note the categories of the user's items, whose pages showed them.
+        # The user may own a great many items, so rather than noting each
+        # item's page, every item page is invalidated (through its coarse
+        # 'items' tag).
+        changed_categories = [
+            cat_id for cat_id, in session.query(Item.cat_id)
+            .filter_by(user_id=user.id).distinct()]
+        changed_pages = ['items'] + [
+            'category:' + category_cache.get_name(cat_id).lower()
+            for cat_id in changed_categories]
+
+        # Delete all of the user's items with a single DELETE statement
+        removed = (
+            session.query(Item).filter_by(user_id=user.id)
+            .delete(synchronize_session=False))
 
         # Now delete the user from the database
         session.delete(user)
 
-        # Commit the changes
+        # Record the change to the catalog and commit the changes (all in the
+        # same transaction).
+        catalog_changed(changed_pages, changed_categories)
         session.commit()
 
         # Clear the login_session
         login_session.clear()
 
-        # Prepare and send the response
-        print('Account deleted')
+        # Prepare and send the response (logging how many items were removed)
+        print('Account deleted ({} items removed)'.format(removed))
         response = make_response(json.dumps('Account deleted'), 200)
         response.headers['Content-Type'] = 'application/json'
         flash('Account deleted')
@@ -509,7 +874,7 @@ def delete_account():
     # Otherwise show the delete account page
     else:
         # Get the categories
-        categories = session.query(Category).all()
+        categories = category_cache.all()
 
         # Create a state token using random letters and numbers
         state = ''.join(random.choice(string.ascii_uppercase + string.digits)
@@ -525,22 +890,18 @@ def delete_account():
 
 # Show the home page (displays most recently added item listings)
 @app.route('/')
+@cached_page('index')
 def index():
     # Get the categories
-    categories = session.query(Category).all()
-
-    # Get the most recently added items
-    recent_items = session.query(Item).order_by(desc(Item.id)).limit(8).all()
+    categories = category_cache.all()
 
-    # Truncate each item's description for its listing
-    for item in recent_items:
-        if len(item.description) > 70:
-            item.description = item.description[:70] + '...'
+    # Get a page of the most recently added items
+    page = get_listing_page(listing_query(), config.HOME_PAGE_SIZE)
 
     # Create a string variable to store the page heading
     page_heading = 'Newest noodles'
     return render_template(
-        'listings.html', categories=categories, items=recent_items,
+        'listings.html', categories=categories, items=page.items, page=page,
         page_heading=page_heading)
 
 
@@ -553,27 +914,23 @@ def show_user_items():
         return redirect(url_for('show_login'))
 
     # Get the categories
-    categories = session.query(Category).all()
-
-    # Get the items added by the user
-    user_items = (
-        session.query(Item).filter_by(user_id=login_session['user_id'])
-        .order_by(desc(Item.id)).all())
+    categories = category_cache.all()
 
-    # Truncate each item's description for its listing
-    for item in user_items:
-        if len(item.description) > 70:
-            item.description = item.description[:70] + '...'
+    # Get a page of the items added by the user
+    page = get_listing_page(
+        listing_query().filter(Item.user_id == login_session['user_id']),
+        config.LISTING_PAGE_SIZE)
 
     # Create a string variable to store the page heading
     page_heading = 'My noodles'
     return render_template(
-        'listings.html', categories=categories, items=user_items,
+        'listings.html', categories=categories, items=page.items, page=page,
         page_heading=page_heading)
 
 
 # Show the desired category (if it exists)
 @app.route('/catalog/<category_arg>')
+@cached_page('category:{category_arg}')
 def show_category(category_arg):
     # Check if all characters in the supplied argument are lowercase. Python
     # docs and the following Stack Overflow post were used as references:
@@ -590,25 +947,22 @@ def show_category(category_arg):
     # Try getting the category ID and categories
     category_id, categories = get_category_id(category_arg)
 
-    # Get the items with the matching category ID
-    items = (
-        session.query(Item).filter_by(cat_id=category_id)
-        .order_by(desc(Item.id)).all())
-
-    # Truncate each item's description for its listing
-    for item in items:
-        if len(item.description) > 70:
-            item.description = item.description[:70] + '...'
+    # Get a page of the items with the matching category ID
+    page = get_listing_page(
+        listing_query().filter(Item.cat_id == category_id),
+        config.LISTING_PAGE_SIZE)
 
     # Create a string variable to store the page heading
     page_heading = '{} noodles'.format(category_arg.title())
     return render_template(
-        'listings.html', categories=categories, items=items,
+        'listings.html', categories=categories, items=page.items, page=page,
         page_heading=page_heading)
 
 
-# Show the desired item (if it exists under the supplied category)
+# Show the desired item (if it exists under the supplied category). Item pages
+# are also tagged 'items', so they can all be invalidated at once.
 @app.route('/catalog/<category_arg>/<item_arg>')
+@cached_page('item:{category_arg}/{item_arg}', 'items')
 def show_item(category_arg, item_arg):
     # Check if all characters in the supplied arguments are lowercase. Python
     # docs and the following Stack Overflow post were used as references:
@@ -629,6 +983,27 @@ def show_item(category_arg, item_arg):
     return render_template('item.html', categories=categories, item=item)
 
 
+# Show the items matching a search (by name and description)
+@app.route('/search')
+def search_items():
+    # Get the categories
+    categories = category_cache.all()
+
+    # Get a page of the best matches
+    query = request.args.get('q', '').strip()
+    page = get_search_page(listing_query(), query, config.LISTING_PAGE_SIZE)
+
+    # Create a string variable to store the page heading
+    if query:
+        page_heading = 'Noodles matching "{}"'.format(query)
+    else:
+        page_heading = 'Search noodles'
+    return render_template(
+        'listings.html', categories=categories, items=page.items, page=page,
+        page_heading=page_heading, search_query=query,
+        search_max_results=config.SEARCH_MAX_RESULTS)
+
+
 # Add a new item
 @app.route('/catalog/new', methods=['GET', 'POST'])
 def new_item():
@@ -638,7 +1013,7 @@ def new_item():
         return redirect(url_for('show_login'))
 
     # Get the categories
-    categories = session.query(Category).all()
+    categories = category_cache.all()
 
     # If a POST request is received, process the form data
     if request.method == 'POST':
@@ -649,6 +1024,7 @@ def new_item():
             description=request.form['description'],
             image_url=request.form['image-url'])
         session.add(new_item)
+        catalog_changed(item_pages(new_item), [int(new_item.cat_id)])
         session.commit()
 
         # Redirect to the home page (with a flash message)
@@ -693,6 +1069,10 @@ def edit_item(category_arg, item_arg):
 
     # If a POST request is received, process the form data
     if request.method == 'POST':
+        # Note the pages (and category) that show the item before it's changed
+        changed_pages = item_pages(item)
+        changed_categories = [item.cat_id]
+
         # Compare each of the properties below with the form data received. If
         # there is a difference, assign the new value. Finally, commit the
         # changes to the database.
@@ -705,6 +1085,9 @@ def edit_item(category_arg, item_arg):
         if request.form['image-url'] != item.image_url:
             item.image_url = request.form['image-url']
         session.add(item)
+        catalog_changed(
+            changed_pages + item_pages(item),
+            changed_categories + [int(item.cat_id)])
         session.commit()
 
         # Redirect to the item page (with a flash message)
@@ -754,6 +1137,7 @@ def delete_item(category_arg, item_arg):
     # If a POST request is received, delete the item and commit the change
     if request.method == 'POST':
         session.delete(item)
+        catalog_changed(item_pages(item), [item.cat_id])
         session.commit()
 
         # After deleting the item, redirect to the home page (with a flash
@@ -767,6 +1151,28 @@ def delete_item(category_arg, item_arg):
             'delete_item.html', categories=categories, item=item)
 
 
+def catalog_changed(changed_pages, changed_categories):
+    """Records a change to the catalog's items (in the categories with the
+    supplied IDs). Called by each route that adds, edits, or deletes items,
+    before it commits its changes. The supplied cached pages (along with the
+    home page) are invalidated once the changes have been committed."""
+    bump_catalog_version(session)
+    bump_category_versions(session, changed_categories)
+    tags = session.info.setdefault('changed_pages', set())
+    tags.add('index')
+    tags.update(changed_pages)
+
+
+def item_pages(item):
+    """Returns the cache tags of the pages that show an item (its category's
+    listings and its own page). The item can be an Item or any row with
+    cat_id and slug columns."""
+    category_arg = category_cache.get_name(int(item.cat_id)).lower()
+    return [
+        'category:' + category_arg,
+        'item:{}/{}'.format(category_arg, item.slug)]
+
+
 def get_user_id(email):
     """Attempts to retrieve a user ID."""
 
@@ -800,16 +1206,8 @@ def add_user(login_session):
 def get_category_id(category_arg):
     """Attempts to retrieve a category ID along with all categories."""
 
-    # Get the categories from the database
-    categories = session.query(Category).all()
-
-    # See if there's a matching category name. If so, we'll get its ID and
-    # break from the loop below.
-    category_id = None
-    for category in categories:
-        if category_arg == category.name.lower():
-            category_id = category.id
-            break
+    # Look up the ID of the category with a matching name
+    category_id = category_cache.get_id(category_arg)
 
     # If there's no match, send a 404 error code
     if category_id is None:
@@ -817,7 +1215,90 @@ def get_category_id(category_arg):
 
     # Otherwise return the category ID and categories
     else:
-        return category_id, categories
+        return category_id, category_cache.all()
+
+
+# A page of item listings. The next and previous pages are identified by the
+# item ID they start before (the previous page's cursor is None when it's the
+# first page).
+ListingPage = namedtuple(
+    'ListingPage', ['items', 'next_before', 'prev_before', 'has_prev'])
+
+
+def listing_query():
+    """Returns a query for just the item columns shown in listings (along with
+    each item's category name, which is used to build its link)."""
+    return (
+        session.query(
+            Item.id, Item.name, Item.slug, Item.summary, Item.image_url,
+            Category.name.label('category_name'))
+        .join(Item.category))
+
+
+def get_listing_page(query, page_size):
+    """Returns a page of the items matched by a query (newest first), starting
+    before the item ID given by the request's 'before' argument. Pages are
+    found by seeking on the item ID rather than by offset, so later pages
+    cost the same as the first one."""
+
+    # Get the page's items, plus one more to see if there's a next page
+    before = request.args.get('before', type=int)
+    page_query = query
+    if before is not None:
+        page_query = page_query.filter(Item.id < before)
+    items = page_query.order_by(desc(Item.id)).limit(page_size + 1).all()
+
+    # If there's a next page, it starts before the last item on this page
+    next_before = None
+    if len(items) > page_size:
+        items = items[:page_size]
+        next_before = items[-1].id
+
+    # The previous page holds the (oldest) items whose IDs come at or after
+    # this page's cursor. If there are more of them than fit on one page, the
+    # previous page starts before the first of the extras. Otherwise it's the
+    # first page.
+    prev_before = None
+    has_prev = False
+    if before is not None:
+        newer_ids = [
+            row.id for row in
+            query.with_entities(Item.id).filter(Item.id >= before)
+            .order_by(Item.id).limit(page_size + 1)]
+        has_prev = len(newer_ids) > 0
+        if len(newer_ids) > page_size:
+            prev_before = newer_ids[page_size]
+
+    return ListingPage(items, next_before, prev_before, has_prev)
+
+
+# A page of search results. Results are ranked rather than ordered by ID, so
+# pages are numbered (from 1). When too many items match to rank them all,
+# only the newest are ranked, and the page is marked as truncated.
+SearchPage = namedtuple(
+    'SearchPage', ['items', 'number', 'has_next', 'truncated'])
+
+
+def get_search_page(query, search_query, page_size):
+    """Returns the page of the items matched by a query that best match a
+    search query, as numbered by the request's 'page' argument."""
+    number = max(1, request.args.get('page', 1, type=int))
+    terms = parse_terms(search_query)
+    if not terms:
+        return SearchPage([], number, False, False)
+
+    # Get the page's items, plus one more to see if there's a next page
+    query, truncated = search(query, terms)
+    items = query.offset((number - 1) * page_size).limit(page_size + 1).all()
+    return SearchPage(
+        items[:page_size], number, len(items) > page_size, truncated)
+
+
+def page_url(before, **kwargs):
+    """Returns the URL of the current page's endpoint, starting before the
+    supplied item ID."""
+    return url_for(
+        request.endpoint, before=before, **dict(request.view_args, **kwargs))
 
 
 def get_item(category_arg, item_arg):
@@ -827,19 +1308,26 @@ def get_item(category_arg, item_arg):
     category_id, categories = get_category_id(category_arg)
 
     # Try getting the item with the matching category ID and name
-    try:
-        # Case insensitive query made possible with .filter() method.
-        # Developed with help from the following Stack Overflow post:
-        # https://stackoverflow.com/a/2128558
-        item = (
-            session.query(Item)
-            .filter(Item.cat_id == category_id, Item.name.ilike(item_arg))
-            .one())
-        return item, categories
+    item = find_item(category_id, item_arg)
 
     # If there's no matching item, send a 404 error code
-    except:
+    if item is None:
         abort(404)
+    return item, categories
+
+
+def find_item(category_id, item_arg):
+    """Returns the item with the supplied (case insensitive) name in the
+    supplied category, or None if there's no such item."""
+
+    # Compare normalized names, so the lookup can use the index on the item's
+    # category ID and slug (on any database, without case folding in SQL). If
+    # several items share the name, the first one added is returned.
+    return (
+        session.query(Item)
+        .filter_by(cat_id=category_id, slug=make_slug(item_arg))
+        .order_by(Item.id)
+        .first())
 
 
 # Run the server if the script is run directly from the Python interpreter
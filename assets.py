@@ -0,0 +1,90 @@
+# Fingerprinted static file URLs. When the app starts, each static file's
+# contents are hashed, and url_for('static', ...) adds the hash to the file
+# name (css/styles.css becomes css/styles.<hash>.css). Since a file's URL
+# changes whenever its contents do, the fingerprinted URLs can be cached by
+# browsers for a year without being revalidated. In debug mode (where the
+# files may be edited while the app is running), the plain URLs are used.
+
+import hashlib
+import os
+import re
+
+# Number of hex digits of a file's hash used in its fingerprinted name
+HASH_LENGTH = 10
+
+# A fingerprinted file name, split into the original name's parts and the hash
+FINGERPRINTED_PATTERN = re.compile(
+    r'^(?P<base>.+)\.(?P<hash>[0-9a-f]{%d})(?P<extension>\.[^./]+)$' %
+    HASH_LENGTH)
+
+# Suffixes of the compressed copies written by build_assets.py (which are
+# sent in place of the files, rather than linked to)
+COPY_SUFFIXES = ('.br', '.gz', '.tmp')
+
+
+def fingerprinted_name(filename, digest):
+    """Returns a file name with a hash added before its extension."""
+    base, extension = os.path.splitext(filename)
+    return '{}.{}{}'.format(base, digest, extension)
+
+
+def build_manifest(directory):
+    """Returns a map of the (slash-separated) names of the files in a
+    directory to their fingerprinted names. Files without an extension keep
+    their plain names, since the fingerprint goes before the extension."""
+    manifest = {}
+    for parent, _, filenames in os.walk(directory):
+        for filename in filenames:
+            if filename.endswith(COPY_SUFFIXES):
+                continue
+            if len(os.path.splitext(filename)[1]) < 2:
+                continue
+            path = os.path.join(parent, filename)
+            with open(path, 'rb') as static_file:
+                digest = hashlib.sha1(
+                    static_file.read()).hexdigest()[:HASH_LENGTH]
+            name = os.path.relpath(path, directory).replace(os.sep, '/')
+            manifest[name] = fingerprinted_name(name, digest)
+    return manifest
+
+
+class AssetManifest(object):
+    """Fingerprints the URLs of an app's static files, and serves the
+    fingerprinted files with far-future cache headers."""
+
+    def __init__(self, app, max_age):
+        self.app = app
+        self.max_age = max_age
+        self.manifest = build_manifest(app.static_folder)
+
+        app.url_defaults(self._fingerprint_url)
+        self._send_static_file = app.view_functions['static']
+        app.view_functions['static'] = self.send_static_file
+
+    def _fingerprint_url(self, endpoint, values):
+        if self.app.debug:
+            return
+        if endpoint == 'static' and 'filename' in values:
+            values['filename'] = self.manifest.get(
+                values['filename'], values['filename'])
+
+    def send_static_file(self, filename):
+        """Sends a static file. If it's requested by its fingerprinted name
+        (and it still has the same contents), it may be cached for good."""
+        match = FINGERPRINTED_PATTERN.match(filename)
+        original = filename
+        if match and match.group('base') + match.group('extension') in (
+                self.manifest):
+            original = match.group('base') + match.group('extension')
+
+        # Pages rendered before the files changed (and cached) may still link
+        # to an old fingerprint, so the current file is sent for any, but
+        # only cached for good when the fingerprint is current
+        response = self._send_static_file(filename=original)
+        if (original != filename and response.status_code == 200 and
+                self.manifest[original] == filename):
+            response.cache_control.public = True
+            response.cache_control.max_age = self.max_age
+            response.cache_control.immutable = True
+            response.cache_control.no_cache = None
+        return response
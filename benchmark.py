@@ -0,0 +1,658 @@
+#!/usr/bin/env python3
+#
+# Benchmarks for the item catalog application. Each benchmark builds throwaway
+# databases filled with synthetic data, points the app at them, and times
+# requests made through Flask's test client. Logins are made against a local
+# stand-in for the providers' APIs.
+
+import argparse
+import base64
+import contextlib
+import json
+import math
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import quote, urlparse
+
+from sqlalchemy.orm import sessionmaker
+
+import app
+import config
+from provider_config import ProviderConfig, load_google_config
+from query_counter import QueryCounter
+from snapshots import build_snapshots
+from storage import create_engines
+from database_setup import Base, User, Category
+from populate_database import bulk_load_items, synthetic_items
+
+
+def build_database(url, num_categories, num_items, batch_size=10000):
+    """Fills a database with synthetic categories and items (dropping any
+    tables it already has), and returns its engines."""
+
+    engines = create_engines(url)
+    Base.metadata.drop_all(engines.writer)
+    Base.metadata.create_all(engines.writer)
+
+    with engines.writer.begin() as connection:
+        connection.execute(User.__table__.insert(), [{
+            'name': 'Bench User',
+            'email': 'bench@email.com'}])
+        connection.execute(Category.__table__.insert(), [
+            {'name': 'Category{}'.format(cat_id)}
+            for cat_id in range(1, num_categories + 1)])
+
+    # Spread the items evenly across the categories
+    bulk_load_items(
+        engines.writer,
+        synthetic_items(num_items, range(1, num_categories + 1)),
+        user_id=1, batch_size=batch_size)
+
+    return engines
+
+
+def sqlite_url(directory, filename):
+    """Returns the URL of a SQLite database file in a directory."""
+    return 'sqlite:///{}'.format(os.path.join(directory, filename))
+
+
+@contextlib.contextmanager
+def temporary_postgres(directory):
+    """Runs a throwaway PostgreSQL server (with initdb and pg_ctl from the
+    PATH) for the duration of the with block, and yields its URL. The server
+    keeps its data in the supplied directory, and only listens on a Unix
+    socket there."""
+    data = os.path.join(directory, 'postgres')
+    subprocess.run(
+        ['initdb', '--pgdata', data, '--username', 'catalog',
+         '--auth', 'trust', '--encoding', 'UTF8'],
+        check=True, stdout=subprocess.DEVNULL)
+    subprocess.run(
+        ['pg_ctl', '--pgdata', data, '--wait',
+         '--log', os.path.join(directory, 'postgres.log'),
+         '--options', "-k {} -c listen_addresses=''".format(directory),
+         'start'],
+        check=True, stdout=subprocess.DEVNULL)
+    try:
+        yield 'postgresql://catalog@/postgres?host={}'.format(directory)
+    finally:
+        subprocess.run(
+            ['pg_ctl', '--pgdata', data, '--wait', '--mode', 'fast', 'stop'],
+            stdout=subprocess.DEVNULL)
+
+
+def use_database(engines, snapshot_dir=''):
+    """Points the app's database session registry at the supplied engines,
+    and the app at the supplied snapshot directory (if any)."""
+    config.SNAPSHOT_DIR = snapshot_dir
+    app.session.remove()
+    app.session.configure(reader=engines.reader, writer=engines.writer)
+    app.category_cache.invalidate()
+    if app.page_cache is not None:
+        app.page_cache.invalidate(['all'])
+
+
+def dispose(engines):
+    """Closes the connections held by a database's engines."""
+    for engine in set(engines):
+        engine.dispose()
+
+
+def time_request(client, url, repeat):
+    """Returns the median time (in seconds) taken to request a URL."""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        response = client.get(url)
+        timings.append(time.perf_counter() - start)
+        assert response.status_code == 200, (url, response.status_code)
+    return statistics.median(timings)
+
+
+def growing_catalogs(args):
+    """Builds (and uses) a series of databases, each one larger than the last
+    by one of the supplied factors. Yields the number of categories and items
+    in each database, along with its engines. With the snapshots argument
+    (which only some benchmarks have), the snapshots of each database are
+    built (and used) too."""
+    with tempfile.TemporaryDirectory() as directory:
+        for factor in args.factors:
+            num_categories = args.categories * factor
+            num_items = args.items * factor
+            engines = build_database(
+                sqlite_url(directory, 'catalog{}.db'.format(factor)),
+                num_categories, num_items)
+            snapshot_dir = ''
+            if getattr(args, 'snapshots', False):
+                snapshot_dir = os.path.join(
+                    directory, 'snapshots{}'.format(factor))
+                with contextlib.closing(
+                        sessionmaker(bind=engines.reader)()) as session:
+                    build_snapshots(
+                        session, snapshot_dir, config.EXPORT_BATCH_SIZE)
+            use_database(engines, snapshot_dir)
+
+            yield num_categories, num_items, engines
+
+            app.session.remove()
+            dispose(engines)
+
+
+class FakeProviderServer(ThreadingHTTPServer):
+    """A local stand-in for the Google and Facebook APIs used at login. Each
+    response is delayed by the supplied latency (in seconds), and the server
+    counts the connections it accepts."""
+
+    daemon_threads = True
+
+    # Canned responses, by request path
+    responses = {
+        '/oauth/access_token': {'access_token': 'long-lived-token'},
+        '/me': {
+            'id': '1234', 'first_name': 'Bench', 'email': 'bench@email.com'},
+        '/me/picture': {'data': {'url': 'https://example.com/bench.jpg'}},
+        '/oauth2/v3/tokeninfo': {'sub': '1234', 'azp': 'bench-client-id'},
+        '/oauth2/v3/userinfo': {
+            'given_name': 'Bench', 'email': 'bench@email.com',
+            'picture': 'https://example.com/bench.jpg'}
+    }
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.connections = 0
+        super().__init__(('127.0.0.1', 0), FakeProviderHandler)
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:{}'.format(self.server_address[1])
+
+    def process_request(self, request, client_address):
+        self.connections += 1
+        super().process_request(request, client_address)
+
+
+class FakeProviderHandler(BaseHTTPRequestHandler):
+    """Answers requests made to a FakeProviderServer (keeping connections
+    alive between them)."""
+
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        time.sleep(self.server.latency)
+        body = json.dumps(
+            self.server.responses.get(urlparse(self.path).path, {})
+        ).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        # Google's token endpoint (the only one reached with a POST) answers
+        # an authorization code with an access token and an ID token.
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        body = json.dumps({
+            'access_token': 'google-token',
+            'expires_in': 3600,
+            'id_token': fake_id_token({
+                'sub': '1234', 'aud': 'bench-client-id',
+                'iss': 'accounts.google.com', 'email': 'bench@email.com'})
+        }).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def fake_id_token(claims):
+    """Returns an (unsigned) ID token holding the supplied claims."""
+    segments = [
+        base64.urlsafe_b64encode(json.dumps(part).encode('utf-8')).rstrip(b'=')
+        for part in ({'alg': 'none'}, claims)]
+    return b'.'.join(segments + [b'']).decode('ascii')
+
+
+def use_fake_providers(server, directory):
+    """Points the app's Google and Facebook logins at a FakeProviderServer,
+    writing a Google client secret file for it to the supplied directory."""
+    path = os.path.join(directory, 'client_secret.json')
+    with open(path, 'w') as secret_file:
+        json.dump({'web': {
+            'client_id': 'bench-client-id',
+            'client_secret': 'bench-client-secret',
+            'redirect_uris': [],
+            'auth_uri': server.url + '/auth',
+            'token_uri': server.url + '/token'}}, secret_file)
+    app.google_config = ProviderConfig(path, load_google_config)
+
+    # The fake ID tokens aren't signed, so have the access tokens checked
+    # against the (fake) API instead.
+    config.GOOGLE_ID_TOKEN_VERIFICATION = 'remote'
+    config.GOOGLE_API_URL = server.url
+    config.FACEBOOK_GRAPH_URL = server.url
+
+
+def time_facebook_logins(server, repeat):
+    """Logs in through /fbconnect (against a FakeProviderServer) and returns
+    the time (in seconds) taken by each login."""
+    config.FACEBOOK_GRAPH_URL = server.url
+    app.app.secret_key = 'benchmark'
+
+    timings = []
+    for _ in range(repeat):
+        client = app.app.test_client()
+        with client.session_transaction() as login_session:
+            login_session['state'] = 'benchmark'
+
+        start = time.perf_counter()
+        response = client.post(
+            '/fbconnect?state=benchmark', data=b'short-lived-token',
+            headers={'X-Requested-With': 'XMLHttpRequest'})
+        timings.append(time.perf_counter() - start)
+        assert response.status_code == 200, response.data
+    return timings
+
+
+def bench_login(args):
+    """Times Facebook logins against a local stand-in for the Graph API, and
+    counts the connections opened to it. With added latency, the number of
+    sequential round trips each login makes is shown too."""
+    server = FakeProviderServer(args.latency / 1000)
+
+    with tempfile.TemporaryDirectory() as directory:
+        engines = build_database(sqlite_url(directory, 'login.db'), 1, 0)
+        use_database(engines)
+        timings = time_facebook_logins(server, args.repeat)
+        app.session.remove()
+        dispose(engines)
+    server.shutdown()
+
+    median = statistics.median(timings)
+    print('logins: {}  median: {:.1f} ms  connections opened: {}'.format(
+        len(timings), median * 1000, server.connections))
+    if args.latency:
+        print('round trips per login: {:.1f}'.format(
+            median / (args.latency / 1000)))
+
+
+def bench_catalog(args):
+    """Shows how /api/catalog scales as categories and items grow together."""
+    client = app.app.test_client()
+    print('{:>10} {:>10} {:>12} {:>14}'.format(
+        'categories', 'items', 'median (ms)', 'us per item'))
+
+    for num_categories, num_items, engines in growing_catalogs(args):
+        seconds = time_request(client, '/api/catalog', args.repeat)
+        print('{:>10} {:>10} {:>12.1f} {:>14.2f}'.format(
+            num_categories, num_items, seconds * 1000,
+            seconds * 1e6 / num_items))
+
+
+def bench_category(args):
+    """Shows that /api/catalog/<category> depends on the size of the category
+    rather than the size of the catalog. Every category holds the same number
+    of items while the catalog grows around it."""
+    client = app.app.test_client()
+    print('{:>10} {:>10} {:>14} {:>12}'.format(
+        'categories', 'items', 'category items', 'median (ms)'))
+
+    for num_categories, num_items, engines in growing_catalogs(args):
+        seconds = time_request(client, '/api/catalog/category1', args.repeat)
+        print('{:>10} {:>10} {:>14} {:>12.1f}'.format(
+            num_categories, num_items, num_items // num_categories,
+            seconds * 1000))
+
+
+def bench_search(args):
+    """Times /api/search on a large catalog, for a few kinds of query. Each
+    synthetic item is named after its number (as in "Noodles 1234"), so a
+    number matches one item, a prefix of a number matches a handful, and
+    "synthetic" (which is in every description) matches them all."""
+    client = app.app.test_client()
+    queries = [
+        ('single term', str(args.items // 2)),
+        ('prefix', str(args.items // 2)[:-1] + '*'),
+        ('two terms', 'noodles {}'.format(args.items // 3)),
+        ('last term typed so far', 'noodles {}'.format(args.items // 3)[:-1]),
+        ('every item', 'synthetic')]
+    print('{:>24} {:>24} {:>12} {:>12}'.format(
+        'query', '', 'median (ms)', 'p95 (ms)'))
+
+    with tempfile.TemporaryDirectory() as directory:
+        start = time.perf_counter()
+        engines = build_database(
+            sqlite_url(directory, 'search.db'), args.categories, args.items,
+            batch_size=50000)
+        print('built {} items in {:.1f}s'.format(
+            args.items, time.perf_counter() - start))
+        use_database(engines)
+
+        for description, query in queries:
+            url = '/api/search?q={}&limit=24'.format(quote(query))
+            client.get(url)
+            timings = []
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                response = client.get(url)
+                timings.append(time.perf_counter() - start)
+                assert response.status_code == 200, (url, response.data)
+            print('{:>24} {:>24} {:>12.2f} {:>12.2f}'.format(
+                description, query, statistics.median(timings) * 1000,
+                percentile(timings, 95) * 1000))
+
+        app.session.remove()
+        dispose(engines)
+
+
+def bench_queries(args):
+    """Counts the SQL statements run by each listing page as the catalog
+    grows, and fails if any page's count isn't constant."""
+    app.app.secret_key = 'benchmark'
+    client = app.app.test_client()
+    with client.session_transaction() as login_session:
+        login_session['username'] = 'Bench User'
+        login_session['user_id'] = 1
+    urls = ['/', '/my-noodles', '/catalog/category1']
+    print('{:>10} {:>10} {}'.format('categories', 'items', '  '.join(
+        '{:>20}'.format(url) for url in urls)))
+
+    counts = {}
+    for num_categories, num_items, engines in growing_catalogs(args):
+        row = []
+        for url in urls:
+            # Warm the category cache, then count a single request
+            client.get(url)
+            with QueryCounter(*engines) as counter:
+                client.get(url)
+            counts.setdefault(url, set()).add(counter.count)
+            row.append('{:>20}'.format(counter.count))
+        print('{:>10} {:>10} {}'.format(
+            num_categories, num_items, '  '.join(row)))
+
+    for url, url_counts in counts.items():
+        assert len(url_counts) == 1, (
+            '{} ran a varying number of statements'.format(url))
+
+
+# A route driven by the route suite. The URL (and form data) may be functions
+# of the request's number, for routes that change the catalog. If prepare is
+# given, it's called with the test client and the request's number before
+# each request (and isn't timed).
+Endpoint = namedtuple(
+    'Endpoint', ['name', 'method', 'url', 'login', 'data', 'headers',
+                 'prepare', 'status'],
+    defaults=('GET', None, False, None, None, None, 200))
+
+# Number of items owned by each account deleted through /delete-account
+ITEMS_PER_DELETED_ACCOUNT = 10
+
+
+def log_in(client, user_id=1, email='bench@email.com', **extra):
+    """Fakes a login by filling in the client's login_session."""
+    with client.session_transaction() as login_session:
+        login_session.clear()
+        login_session.update(
+            username='Bench User', user_id=user_id, email=email,
+            picture='https://example.com/bench.jpg', provider='facebook',
+            facebook_id='1234', access_token='bench-token', **extra)
+
+
+def expect_login(client, n):
+    """Prepares a client to log in (by giving it a state token)."""
+    with client.session_transaction() as login_session:
+        login_session.clear()
+        login_session['state'] = 'benchmark'
+
+
+def route_endpoints(engines):
+    """Returns the endpoints driven by the route suite, covering every route
+    in the app. Pages are requested first, then the routes that change the
+    catalog (so items added by one can be deleted by another)."""
+
+    def add_doomed_account(client, n):
+        # Add a user with some items, and log in as them
+        email = 'doomed{}@email.com'.format(n)
+        with engines.writer.begin() as connection:
+            result = connection.execute(User.__table__.insert(), {
+                'name': 'Doomed User', 'email': email})
+        user_id = result.inserted_primary_key[0]
+        bulk_load_items(engines.writer, synthetic_items(
+            ITEMS_PER_DELETED_ACCOUNT, [1]), user_id)
+        log_in(client, user_id, email, delete_account_state='benchmark')
+
+    item = '/catalog/category1/noodles%200'
+    ajax = {'X-Requested-With': 'XMLHttpRequest'}
+    return [
+        Endpoint('GET /', url='/'),
+        Endpoint('GET /catalog/<category>', url='/catalog/category1'),
+        Endpoint('GET /catalog/<category>/<item>', url=item),
+        Endpoint('GET /privacy-policy', url='/privacy-policy'),
+        Endpoint('GET /login', url='/login'),
+        Endpoint('GET /api/catalog', url='/api/catalog'),
+        Endpoint('GET /api/catalog/<category>', url='/api/catalog/category1'),
+        Endpoint('GET /api/catalog/<category>?limit',
+                 url='/api/catalog/category1?limit=100'),
+        Endpoint('GET /api/catalog/<category>/<item>',
+                 url='/api/catalog/category1/noodles%200'),
+        Endpoint('GET /search', url='/search?q=noodles%2042'),
+        Endpoint('GET /api/search', url='/api/search?q=noodles%2042'),
+        Endpoint('GET /my-noodles', url='/my-noodles', login=True),
+        Endpoint('GET /catalog/new', url='/catalog/new', login=True),
+        Endpoint('GET /catalog/<category>/<item>/edit', url=item + '/edit',
+                 login=True),
+        Endpoint('GET /catalog/<category>/<item>/delete',
+                 url=item + '/delete', login=True),
+        Endpoint('GET /delete-account', url='/delete-account', login=True),
+        Endpoint('POST /catalog/new', 'POST', '/catalog/new', login=True,
+                 data=lambda n: {
+                     'category-id': '1', 'name': 'Bench Item {}'.format(n),
+                     'description': 'Added by the route suite.',
+                     'image-url': 'https://example.com/bench.jpg'},
+                 status=302),
+        Endpoint('POST /catalog/<category>/<item>/edit', 'POST',
+                 item + '/edit', login=True,
+                 data=lambda n: {
+                     'category-id': '1', 'name': 'Noodles 0',
+                     'description': 'Edit number {}.'.format(n),
+                     'image-url': 'https://example.com/0.jpg'},
+                 status=302),
+        Endpoint('POST /catalog/<category>/<item>/delete', 'POST',
+                 lambda n: '/catalog/category1/bench%20item%20{}/delete'
+                 .format(n), login=True, status=302),
+        Endpoint('POST /gconnect', 'POST', '/gconnect?state=benchmark',
+                 data=b'auth-code', headers=ajax, prepare=expect_login),
+        Endpoint('POST /fbconnect', 'POST', '/fbconnect?state=benchmark',
+                 data=b'short-lived-token', headers=ajax,
+                 prepare=expect_login),
+        Endpoint('POST /logout', 'POST', '/logout',
+                 prepare=lambda client, n: log_in(client)),
+        Endpoint('POST /delete-account', 'POST',
+                 '/delete-account?state=benchmark', headers=ajax,
+                 prepare=add_doomed_account),
+    ]
+
+
+def percentile(timings, percent):
+    """Returns a percentile of the timings (by the nearest-rank method)."""
+    ordered = sorted(timings)
+    return ordered[max(1, math.ceil(percent / 100 * len(ordered))) - 1]
+
+
+def run_endpoint(endpoint, engines, repeat):
+    """Requests an endpoint repeatedly, returning its latency percentiles
+    (in milliseconds), throughput, and SQL statement counts."""
+    client = app.app.test_client()
+    if endpoint.login:
+        log_in(client)
+
+    timings = []
+    queries = []
+    for n in range(repeat):
+        if endpoint.prepare is not None:
+            endpoint.prepare(client, n)
+        url = endpoint.url(n) if callable(endpoint.url) else endpoint.url
+        data = endpoint.data(n) if callable(endpoint.data) else endpoint.data
+
+        with QueryCounter(*engines) as counter:
+            start = time.perf_counter()
+            response = client.open(
+                url, method=endpoint.method, data=data,
+                headers=endpoint.headers)
+            timings.append(time.perf_counter() - start)
+        queries.append(counter.count)
+        assert response.status_code == endpoint.status, (
+            endpoint.name, response.status_code)
+
+    return {
+        'method': endpoint.method,
+        'requests': repeat,
+        'p50_ms': round(percentile(timings, 50) * 1000, 3),
+        'p95_ms': round(percentile(timings, 95) * 1000, 3),
+        'p99_ms': round(percentile(timings, 99) * 1000, 3),
+        'mean_ms': round(statistics.mean(timings) * 1000, 3),
+        'throughput_rps': round(repeat / sum(timings), 1),
+        'queries_mean': round(statistics.mean(queries), 2),
+        'queries_max': max(queries)}
+
+
+def bench_routes(args):
+    """Drives every route in the app against a database of the requested
+    size, and writes each endpoint's latency percentiles, throughput, and
+    SQL statement counts as JSON."""
+    app.app.secret_key = 'benchmark'
+    if args.no_page_cache:
+        app.page_cache = None
+    server = FakeProviderServer(0)
+
+    endpoints = {}
+    with contextlib.ExitStack() as stack:
+        directory = stack.enter_context(tempfile.TemporaryDirectory())
+        if args.postgres:
+            url = stack.enter_context(temporary_postgres(directory))
+        else:
+            url = args.database_url or sqlite_url(directory, 'routes.db')
+        engines = build_database(url, args.categories, args.items)
+        use_database(engines)
+        use_fake_providers(server, directory)
+
+        # Send anything the app prints to stderr, keeping stdout for the
+        # report.
+        with contextlib.redirect_stdout(sys.stderr):
+            for endpoint in route_endpoints(engines):
+                endpoints[endpoint.name] = run_endpoint(
+                    endpoint, engines, args.repeat)
+
+        app.session.remove()
+        dispose(engines)
+    server.shutdown()
+
+    report = {
+        'timestamp': datetime.now(timezone.utc).isoformat(),
+        'database': engines.writer.dialect.name,
+        'categories': args.categories,
+        'items': args.items,
+        'page_cache': app.page_cache is not None,
+        'endpoints': endpoints}
+    if args.output:
+        with open(args.output, 'w') as report_file:
+            json.dump(report, report_file, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmarks for the item catalog application.')
+    subparsers = parser.add_subparsers(dest='benchmark')
+    subparsers.required = True
+
+    catalog = subparsers.add_parser(
+        'catalog', help='time /api/catalog against growing catalogs')
+    catalog.add_argument('--categories', type=int, default=10)
+    catalog.add_argument('--items', type=int, default=2000)
+    catalog.add_argument(
+        '--factors', type=int, nargs='+', default=[1, 2, 4, 8])
+    catalog.add_argument('--repeat', type=int, default=5)
+    catalog.add_argument(
+        '--snapshots', action='store_true',
+        help='build snapshots of each catalog and serve them')
+    catalog.set_defaults(func=bench_catalog)
+
+    category = subparsers.add_parser(
+        'category', help='time /api/catalog/<category> as the catalog grows')
+    category.add_argument('--categories', type=int, default=10)
+    category.add_argument('--items', type=int, default=2000)
+    category.add_argument(
+        '--factors', type=int, nargs='+', default=[1, 4, 16, 64])
+    category.add_argument('--repeat', type=int, default=5)
+    category.add_argument(
+        '--snapshots', action='store_true',
+        help='build snapshots of each catalog and serve them')
+    category.set_defaults(func=bench_category)
+
+    queries = subparsers.add_parser(
+        'queries', help='count the SQL statements run by listing pages')
+    queries.add_argument('--categories', type=int, default=2)
+    queries.add_argument('--items', type=int, default=10)
+    queries.add_argument(
+        '--factors', type=int, nargs='+', default=[1, 10, 100])
+    queries.set_defaults(func=bench_queries)
+
+    search = subparsers.add_parser(
+        'search', help='time /api/search on a large catalog')
+    search.add_argument('--categories', type=int, default=10)
+    search.add_argument('--items', type=int, default=1000000)
+    search.add_argument('--repeat', type=int, default=20)
+    search.set_defaults(func=bench_search)
+
+    login = subparsers.add_parser(
+        'login', help='time logins against a local provider stand-in')
+    login.add_argument(
+        '--latency', type=float, default=0,
+        help='delay (in milliseconds) added to each provider response')
+    login.add_argument('--repeat', type=int, default=20)
+    login.set_defaults(func=bench_login)
+
+    routes = subparsers.add_parser(
+        'routes', help='drive every route and report timings as JSON')
+    routes.add_argument('--categories', type=int, default=10)
+    routes.add_argument('--items', type=int, default=10000)
+    routes.add_argument('--repeat', type=int, default=50)
+    routes.add_argument(
+        '--no-page-cache', action='store_true',
+        help='render every page instead of serving cached copies')
+    database = routes.add_mutually_exclusive_group()
+    database.add_argument(
+        '--database-url',
+        help='URL of a throwaway database to run against (its tables are '
+             'dropped and re-created; default: a temporary SQLite file)')
+    database.add_argument(
+        '--postgres', action='store_true',
+        help='run against a temporary local PostgreSQL server (needs '
+             'initdb and pg_ctl on the PATH, and psycopg2)')
+    routes.add_argument(
+        '--output', help='file to write the report to (default: stdout)')
+    routes.set_defaults(func=bench_routes)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
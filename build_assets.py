@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+#
+# Writes compressed copies of the static files (a .gz copy of each, and a .br
+# copy if the brotli package is installed), which the app sends to clients
+# that accept them instead of compressing the files on every request. Run it
+# after changing the static files:
+#
+#   python3 build_assets.py
+
+import argparse
+import mimetypes
+import os
+
+import config
+from compression import COMPRESSIBLE_MIMETYPES, ENCODINGS, brotli, compress
+
+# Directory holding the static files
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+
+# Compression levels used for the copies (they're only made once, so the
+# slowest, smallest settings are used)
+GZIP_LEVEL = 9
+BROTLI_QUALITY = 11
+
+
+def static_files(directory):
+    """Yields the paths of the static files worth compressing."""
+    for parent, _, filenames in os.walk(directory):
+        for filename in sorted(filenames):
+            if mimetypes.guess_type(filename)[0] in COMPRESSIBLE_MIMETYPES:
+                yield os.path.join(parent, filename)
+
+
+def build_copies(path, min_size, force=False):
+    """Writes the compressed copies of a file that are missing or older than
+    the file. Copies that wouldn't be smaller than the file are removed
+    instead. Returns the number of copies written."""
+    written = 0
+    modified = os.path.getmtime(path)
+    with open(path, 'rb') as source:
+        data = source.read()
+    for encoding, suffix in ENCODINGS:
+        copy_path = path + suffix
+        if encoding == 'br' and brotli is None:
+            continue
+        if (not force and os.path.exists(copy_path) and
+                os.path.getmtime(copy_path) >= modified):
+            continue
+
+        compressed = compress(data, encoding, GZIP_LEVEL, BROTLI_QUALITY)
+        if len(data) < min_size or len(compressed) >= len(data):
+            if os.path.exists(copy_path):
+                os.remove(copy_path)
+            continue
+        with open(copy_path + '.tmp', 'wb') as copy:
+            copy.write(compressed)
+        os.replace(copy_path + '.tmp', copy_path)
+        written += 1
+    return written
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Writes compressed copies of the static files.')
+    parser.add_argument(
+        '--min-size', type=int, default=config.COMPRESSION_MIN_SIZE,
+        help='smallest file (in bytes) worth compressing '
+             '(default: %(default)s)')
+    parser.add_argument(
+        '--force', action='store_true',
+        help='rewrite every copy, even if it is up to date')
+    args = parser.parse_args()
+    if brotli is None:
+        print('The brotli package is not installed, so only gzip-compressed '
+              'copies will be written.')
+
+    written = 0
+    for path in static_files(STATIC_DIR):
+        written += build_copies(path, args.min_size, args.force)
+    print('Wrote {} compressed cop{}'.format(
+        written, 'y' if written == 1 else 'ies'))
+
+
+if __name__ == '__main__':
+    main()
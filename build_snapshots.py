@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+#
+# Builds the snapshots of the catalog and category data served by the JSON
+# API (see snapshots.py). Only the categories whose items have changed since
+# the last build are rebuilt, so this can be run regularly (from cron, say):
+#
+#   python3 build_snapshots.py
+#   python3 build_snapshots.py --force --output-dir /var/lib/catalog/snapshots
+
+import argparse
+import sys
+import time
+
+from sqlalchemy.orm import sessionmaker
+
+import config
+from snapshots import brotli, build_snapshots
+from storage import get_engines
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Builds (or brings up to date) the snapshots of the '
+                    'catalog and category data served by the JSON API.')
+    parser.add_argument(
+        '--output-dir', default=config.SNAPSHOT_DIR,
+        help='directory the snapshots are written to (default: %(default)s)')
+    parser.add_argument(
+        '--batch-size', type=int, default=config.EXPORT_BATCH_SIZE,
+        help='items read from the database at a time '
+             '(default: %(default)s)')
+    parser.add_argument(
+        '--force', action='store_true',
+        help='rebuild every snapshot, even if it is current')
+    args = parser.parse_args()
+    if not args.output_dir:
+        sys.exit('Error. No output directory.')
+    if brotli is None:
+        print('The brotli package is not installed, so only gzip-compressed '
+              'copies will be written.')
+
+    # Read the data through the reader engine
+    session = sessionmaker(bind=get_engines().reader)()
+    start = time.perf_counter()
+    try:
+        rebuilt = build_snapshots(
+            session, args.output_dir, args.batch_size, args.force)
+    finally:
+        session.close()
+
+    print('Rebuilt {} category snapshot{} in {:.1f}s'.format(
+        rebuilt, '' if rebuilt == 1 else 's', time.perf_counter() - start))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+# An in-process cache of the catalog's categories. Categories rarely change,
+# so rather than querying them on every page render, they're loaded once and
+# kept in memory until they're invalidated (or their time-to-live runs out).
+
+import threading
+import time
+from collections import namedtuple
+
+from sqlalchemy import event
+
+from database_setup import Category
+
+# A lightweight copy of a category row. Unlike a Category instance, it isn't
+# tied to a session, so it can safely be shared between requests and threads.
+CachedCategory = namedtuple('CachedCategory', ['id', 'name'])
+
+
+class CategoryCache(object):
+    """Caches the categories along with name-to-ID and ID-to-name maps."""
+
+    def __init__(self, session, ttl):
+        self.session = session
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._loaded_at = None
+        self._categories = []
+        self._ids_by_name = {}
+        self._names_by_id = {}
+
+    def _load(self):
+        """Loads the categories unless a fresh copy is already cached."""
+        with self._lock:
+            if (self._loaded_at is not None and
+                    time.monotonic() - self._loaded_at < self.ttl):
+                return
+
+            categories = [
+                CachedCategory(*row) for row in
+                self.session.query(Category.id, Category.name)
+                .order_by(Category.id)]
+            self._categories = categories
+            self._ids_by_name = {
+                category.name.lower(): category.id for category in categories}
+            self._names_by_id = {
+                category.id: category.name for category in categories}
+            self._loaded_at = time.monotonic()
+
+    def all(self):
+        """Returns a list of all categories."""
+        self._load()
+        return self._categories
+
+    def get_id(self, name):
+        """Returns the ID of the category with the supplied (case insensitive)
+        name, or None if there's no such category."""
+        self._load()
+        return self._ids_by_name.get(name.lower())
+
+    def get_name(self, category_id):
+        """Returns the name of the category with the supplied ID, or None if
+        there's no such category."""
+        self._load()
+        return self._names_by_id.get(category_id)
+
+    def invalidate(self):
+        """Discards the cached categories so they're reloaded on next use."""
+        with self._lock:
+            self._loaded_at = None
+
+    def invalidate_on_change(self):
+        """Invalidates the cache whenever a category is added, changed, or
+        deleted through the ORM."""
+        for event_name in ('after_insert', 'after_update', 'after_delete'):
+            event.listen(
+                Category, event_name,
+                lambda mapper, connection, target: self.invalidate())
@@ -0,0 +1,170 @@
+# Compression of responses. Pages and JSON responses are compressed with
+# brotli (if the brotli package is installed) or gzip, whichever the client
+# prefers, once they're large enough to be worth it (streamed responses are
+# compressed a chunk at a time, as they're sent). Static files are sent
+# from compressed copies made ahead of time (by build_assets.py) instead, so
+# the same bytes aren't compressed again on every request.
+#
+# A compressed response's ETag gets the encoding as a suffix (as in
+# "abc123-gzip"), since it's a different representation from the
+# uncompressed one.
+
+import gzip
+import mimetypes
+import os
+import zlib
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+from flask import request, send_from_directory
+from werkzeug.security import safe_join
+
+# Content encodings, in order of preference, with the file name suffixes of
+# precompressed copies. Sending a brotli-compressed copy doesn't need the
+# brotli package, but compressing a response does.
+ENCODINGS = [('br', '.br'), ('gzip', '.gz')]
+
+# Types of content worth compressing (images and fonts are compressed
+# already)
+COMPRESSIBLE_MIMETYPES = frozenset([
+    'application/javascript', 'application/json', 'application/x-ndjson',
+    'image/svg+xml', 'text/css', 'text/html', 'text/javascript',
+    'text/plain'])
+
+
+def encoded_etag(etag, encoding):
+    """Returns the ETag of a representation with the supplied content
+    encoding (None if it isn't encoded)."""
+    if encoding is None:
+        return etag
+    return '{}-{}'.format(etag, encoding)
+
+
+def choose_encoding(accept_encodings):
+    """Returns the content encoding to compress a response with for a client
+    (the first it accepts, in order of preference), or None if it accepts
+    none of them."""
+    for encoding, _ in ENCODINGS:
+        if encoding == 'br' and brotli is None:
+            continue
+        if accept_encodings.quality(encoding) > 0:
+            return encoding
+    return None
+
+
+def etag_variants(etag, accept_encodings):
+    """Returns the ETags of the representations of a response that could be
+    sent to a client: the uncompressed one (sent when the response is too
+    small to compress), and the one compressed with the encoding chosen for
+    the client (if any)."""
+    encoding = choose_encoding(accept_encodings)
+    if encoding is None:
+        return [etag]
+    return [etag, encoded_etag(etag, encoding)]
+
+
+def compress(data, encoding, gzip_level, brotli_quality):
+    """Compresses data with the supplied content encoding."""
+    if encoding == 'br':
+        return brotli.compress(data, quality=brotli_quality)
+    return gzip.compress(data, gzip_level, mtime=0)
+
+
+def compress_stream(chunks, encoding, gzip_level, brotli_quality):
+    """Compresses a stream of chunks with the supplied content encoding. The
+    compressed data is flushed after each chunk, so the client receives it as
+    soon as it's been produced."""
+    if encoding == 'br':
+        compressor = brotli.Compressor(quality=brotli_quality)
+        for chunk in chunks:
+            yield compressor.process(chunk) + compressor.flush()
+        yield compressor.finish()
+    else:
+        compressor = zlib.compressobj(
+            gzip_level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        for chunk in chunks:
+            yield compressor.compress(chunk) + compressor.flush(
+                zlib.Z_SYNC_FLUSH)
+        yield compressor.flush()
+
+
+class Compression(object):
+    """Compresses an app's responses, and serves its static files from
+    precompressed copies (when they're up to date)."""
+
+    def __init__(self, app, min_size, gzip_level, brotli_quality):
+        self.app = app
+        self.min_size = min_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+
+        app.after_request(self._compress_response)
+        app.view_functions['static'] = self.send_static_file
+
+    def _compress_response(self, response):
+        if response.mimetype not in COMPRESSIBLE_MIMETYPES:
+            return response
+        response.vary.add('Accept-Encoding')
+
+        # Leave alone responses that are already encoded, that are sent
+        # straight from a file, and that are too small to gain much
+        if (response.status_code != 200 or response.content_encoding or
+                response.direct_passthrough or (
+                    not response.is_streamed and
+                    response.calculate_content_length() < self.min_size)):
+            return response
+        encoding = choose_encoding(request.accept_encodings)
+        if encoding is None:
+            return response
+
+        if response.is_streamed:
+            # Compress the chunks as they're sent (closing the original
+            # stream along with the response)
+            stream = response.response
+            response.response = compress_stream(
+                response.iter_encoded(), encoding, self.gzip_level,
+                self.brotli_quality)
+            if hasattr(stream, 'close'):
+                response.call_on_close(stream.close)
+            response.headers.pop('Content-Length', None)
+        else:
+            response.set_data(compress(
+                response.get_data(), encoding, self.gzip_level,
+                self.brotli_quality))
+        response.content_encoding = encoding
+        etag, weak = response.get_etag()
+        if etag is not None:
+            response.set_etag(encoded_etag(etag, encoding), weak)
+        return response
+
+    def send_static_file(self, filename):
+        """Sends a static file, or its precompressed copy (if there's one at
+        least as new as the file, in an encoding the client accepts)."""
+        folder = self.app.static_folder
+        path = safe_join(folder, filename)
+        mimetype = mimetypes.guess_type(filename)[0]
+        if (path is None or not os.path.isfile(path) or
+                mimetype not in COMPRESSIBLE_MIMETYPES):
+            return self.app.send_static_file(filename)
+
+        modified = os.path.getmtime(path)
+        for encoding, suffix in ENCODINGS:
+            if request.accept_encodings.quality(encoding) <= 0:
+                continue
+            try:
+                if os.path.getmtime(path + suffix) < modified:
+                    continue
+            except OSError:
+                continue
+            response = send_from_directory(
+                folder, filename + suffix, mimetype=mimetype,
+                max_age=self.app.get_send_file_max_age(filename))
+            response.content_encoding = encoding
+            break
+        else:
+            response = self.app.send_static_file(filename)
+        response.vary.add('Accept-Encoding')
+        return response
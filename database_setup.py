@@ -1,12 +1,28 @@
-from sqlalchemy import Column, ForeignKey, Integer, String
+from datetime import datetime
+
+from sqlalchemy import Column, DateTime, ForeignKey, Index, Integer, String
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import relationship, sessionmaker
-from sqlalchemy import create_engine
+from sqlalchemy.orm import relationship, sessionmaker, validates
+from sqlalchemy import event, inspect, text
+
+from storage import get_engines
 
 # Return a new base class and store its value in the Base variable
 Base = declarative_base()
 
 
+def make_slug(name):
+    """Returns the normalized form of a name, as used in URLs and lookups."""
+    return name.lower()
+
+
+def make_summary(description):
+    """Returns a description truncated for use in an item's listing."""
+    if description is not None and len(description) > 70:
+        return description[:70] + '...'
+    return description
+
+
 class User(Base):
     """Model class for storing user information."""
     __tablename__ = 'user'
@@ -24,17 +40,20 @@ class Category(Base):
     id = Column(Integer, primary_key=True)
     name = Column(String(250), nullable=False)
 
+    # Incremented whenever one of the category's items is added, edited, or
+    # deleted (so copies of its data, such as snapshots, can be checked)
+    version = Column(Integer, nullable=False, default=0)
+
     # Approach towards JSONifying and presenting data was made possible with
     # help from the following Stack Overflow post and responses:
     # https://stackoverflow.com/q/28910217
     def serialize(self, items):
-        """Serializes category data for use on a JSON endpoint."""
+        """Serializes category data for use on a JSON endpoint. The supplied
+        items should be the ones belonging to the category."""
         return {
             'id': self.id,
             'name': self.name,
-            'items': [
-                item.serialize() for item in items if item.cat_id == self.id
-            ]
+            'items': [item.serialize() for item in items]
         }
 
 
@@ -42,15 +61,32 @@ class Item(Base):
     """Model class for storing an item."""
     __tablename__ = 'item'
 
+    # Items are looked up by category and (normalized) name, so index both
+    __table_args__ = (Index('ix_item_cat_id_slug', 'cat_id', 'slug'),)
+
     id = Column(Integer, primary_key=True)
     name = Column(String(80), nullable=False)
+    slug = Column(String(80))
     description = Column(String(800))
+    summary = Column(String(73))
     image_url = Column(String(250))
-    cat_id = Column(Integer, ForeignKey('category.id'))
+    cat_id = Column(Integer, ForeignKey('category.id'), index=True)
     category = relationship(Category)
-    user_id = Column(Integer, ForeignKey('user.id'))
+    user_id = Column(Integer, ForeignKey('user.id'), index=True)
     user = relationship(User)
 
+    @validates('name')
+    def update_slug(self, key, name):
+        """Keeps the item's slug in sync with its name."""
+        self.slug = make_slug(name)
+        return name
+
+    @validates('description')
+    def update_summary(self, key, description):
+        """Keeps the item's (listing) summary in sync with its description."""
+        self.summary = make_summary(description)
+        return description
+
     def serialize(self):
         """Serializes item data for use on a JSON endpoint."""
         return {
@@ -60,12 +96,166 @@ class Item(Base):
             'description': self.description
         }
 
-# Create (if it doesn't exist) and connect to the database
-engine = create_engine('sqlite:///catalog.db')
+class CatalogState(Base):
+    """Model class for storing the catalog's version. There's a single row,
+    which is updated whenever an item is added, edited, or deleted."""
+    __tablename__ = 'catalog_state'
+
+    id = Column(Integer, primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+    modified = Column(DateTime, nullable=False, default=datetime.utcnow)
+
+
+# Add the catalog state's single row along with its table
+event.listen(
+    CatalogState.__table__, 'after_create',
+    lambda table, connection, **kwargs: connection.execute(
+        table.insert(), [{'id': 1}]))
+
+
+def bump_catalog_version(session):
+    """Increments the catalog's version as part of the session's current
+    transaction (so the new version is committed along with the changes)."""
+    session.query(CatalogState).filter_by(id=1).update({
+        'version': CatalogState.version + 1,
+        'modified': datetime.utcnow()}, synchronize_session=False)
+
+
+def bump_category_versions(session, category_ids=None):
+    """Increments the versions of the categories with the supplied IDs (or of
+    every category) as part of the session's current transaction."""
+    query = session.query(Category)
+    if category_ids is not None:
+        query = query.filter(Category.id.in_(set(category_ids)))
+    query.update(
+        {'version': Category.version + 1}, synchronize_session=False)
+
+
+# Statements that create the full-text search index over item names and
+# descriptions (used by search.py), and the triggers that keep it up to date.
+# The index stores no copy of the text (it reads it from the item table when
+# needed), and also indexes 2- and 3-character prefixes, so that queries for
+# short prefixes stay fast.
+SEARCH_INDEX_STATEMENTS = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS item_fts USING fts5(
+        name, description, content='item', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3')""",
+    """CREATE TRIGGER IF NOT EXISTS item_fts_insert AFTER INSERT ON item
+    BEGIN
+        INSERT INTO item_fts (rowid, name, description)
+        VALUES (new.id, new.name, new.description);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS item_fts_delete AFTER DELETE ON item
+    BEGIN
+        INSERT INTO item_fts (item_fts, rowid, name, description)
+        VALUES ('delete', old.id, old.name, old.description);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS item_fts_update
+    AFTER UPDATE OF name, description ON item
+    BEGIN
+        INSERT INTO item_fts (item_fts, rowid, name, description)
+        VALUES ('delete', old.id, old.name, old.description);
+        INSERT INTO item_fts (rowid, name, description)
+        VALUES (new.id, new.name, new.description);
+    END"""]
+
+
+def create_search_index(connection):
+    """Creates the search index and its triggers (if they don't exist yet) on
+    a SQLite database, indexing any items already in the database."""
+    if connection.dialect.name != 'sqlite':
+        return
+    exists = connection.execute(text(
+        "SELECT 1 FROM sqlite_master WHERE name = 'item_fts'")).first()
+    for statement in SEARCH_INDEX_STATEMENTS:
+        connection.execute(text(statement))
+    if exists is None:
+        connection.execute(
+            text("INSERT INTO item_fts (item_fts) VALUES ('rebuild')"))
+
+
+def drop_search_index(connection):
+    """Drops the search index (its triggers are dropped with the item
+    table)."""
+    if connection.dialect.name == 'sqlite':
+        connection.execute(text('DROP TABLE IF EXISTS item_fts'))
+
+
+# Create and drop the search index along with the item table
+event.listen(
+    Item.__table__, 'after_create',
+    lambda table, connection, **kwargs: create_search_index(connection))
+event.listen(
+    Item.__table__, 'before_drop',
+    lambda table, connection, **kwargs: drop_search_index(connection))
+
+
+# Create (if it doesn't exist) and connect to the database (through its
+# writer engine, since everything below writes to it)
+engine = get_engines().writer
 
 # Add the model classes as new tables in the database
 Base.metadata.create_all(engine)
 
+
+def addMissingItemColumns():
+    """Adds (and fills in) item columns that were introduced after the item
+    table was first created."""
+
+    # Get the names of the item table's existing columns
+    columns = [
+        column['name'] for column in inspect(engine).get_columns('item')]
+
+    # Each new column is listed with its type, along with the column and
+    # function used to compute its value for existing items.
+    new_columns = [
+        ('slug', 'VARCHAR(80)', 'name', make_slug),
+        ('summary', 'VARCHAR(73)', 'description', make_summary)]
+
+    for name, column_type, source, compute in new_columns:
+        if name in columns:
+            continue
+        with engine.begin() as connection:
+            connection.execute(text(
+                'ALTER TABLE item ADD COLUMN {} {}'.format(name, column_type)))
+            items = connection.execute(
+                text('SELECT id, {} AS source FROM item'.format(source)))
+            values = [
+                {'id': item.id, 'value': compute(item.source)}
+                for item in items]
+            if values:
+                connection.execute(
+                    text('UPDATE item SET {} = :value WHERE id = :id'
+                         .format(name)),
+                    values)
+
+addMissingItemColumns()
+
+
+def addMissingCategoryColumns():
+    """Adds category columns that were introduced after the category table
+    was first created."""
+    columns = [
+        column['name'] for column in inspect(engine).get_columns('category')]
+    if 'version' not in columns:
+        with engine.begin() as connection:
+            connection.execute(text(
+                'ALTER TABLE category ADD COLUMN version INTEGER NOT NULL '
+                'DEFAULT 0'))
+
+addMissingCategoryColumns()
+
+# Add any indexes missing from tables that were created by an earlier version
+# of this file (create_all() only creates indexes along with new tables).
+for table in Base.metadata.sorted_tables:
+    for index in table.indexes:
+        index.create(engine, checkfirst=True)
+
+# Create the search index on databases created by an earlier version of this
+# file (indexing their existing items)
+with engine.begin() as connection:
+    create_search_index(connection)
+
 # Bind the engine to the Base class
 Base.metadata.bind = engine
 
@@ -82,31 +272,28 @@ def addCategories():
     # Add the Chinese category
     cat1 = Category(name='Chinese')
     session.add(cat1)
-    session.commit()
 
     # Add the Japanese category
     cat2 = Category(name='Japanese')
     session.add(cat2)
-    session.commit()
 
     # Add the Korean category
     cat3 = Category(name='Korean')
     session.add(cat3)
-    session.commit()
 
     # Add the Thai category
     cat4 = Category(name='Thai')
     session.add(cat4)
-    session.commit()
 
     # Add the Vietnamese category
     cat5 = Category(name='Vietnamese')
     session.add(cat5)
-    session.commit()
 
     # Add the Other category
     cat6 = Category(name='Other')
     session.add(cat6)
+
+    # Save all of the categories in one transaction
     session.commit()
 
     print('Categories added!')
@@ -114,3 +301,13 @@ def addCategories():
 # Populate the database with categories (if they don't exist)
 if len(session.query(Category).all()) == 0:
     addCategories()
+
+# Add the catalog state row to databases created by an earlier version of
+# this file (if it doesn't exist)
+if session.query(CatalogState).get(1) is None:
+    session.add(CatalogState(id=1))
+    session.commit()
+
+# Close the session, returning its connection (the writer connection) to the
+# pool for the application to use
+session.close()
@@ -0,0 +1,57 @@
+# Streaming exports of the whole catalog. Rather than loading every item and
+# building the response in memory, the items are read from the database a
+# batch at a time and written out as they're read, so memory use stays the
+# same however large the catalog grows, and the first bytes are sent straight
+# away.
+
+from database_setup import Category, Item
+
+
+def category_items(session, category, batch_size):
+    """Yields a category's items (oldest first), fetching batch_size rows from
+    the database at a time."""
+    return (
+        session.query(Item).filter_by(cat_id=category.id)
+        .order_by(Item.id).yield_per(batch_size))
+
+
+def catalog_json(session, dumps, batch_size):
+    """Yields the catalog as a JSON document, in pieces. Given a dumps that
+    sorts keys and leaves out whitespace (as jsonify() does), the document
+    is identical to the non-streaming /api/catalog response."""
+    yield '{"categories":['
+    for i, category in enumerate(
+            session.query(Category).order_by(Category.id)):
+        yield '{}{{"id":{},"items":['.format(
+            ',' if i else '', dumps(category.id))
+        for j, item in enumerate(
+                category_items(session, category, batch_size)):
+            yield (',' if j else '') + dumps(item.serialize())
+        yield '],"name":{}}}'.format(dumps(category.name))
+    yield ']}\n'
+
+
+def catalog_ndjson(session, dumps, batch_size):
+    """Yields the catalog as newline-delimited JSON: a line for each category,
+    followed by a line for each of its items."""
+    for category in session.query(Category).order_by(Category.id):
+        yield dumps({'category': {'id': category.id,
+                                  'name': category.name}}) + '\n'
+        for item in category_items(session, category, batch_size):
+            yield dumps({'item': item.serialize()}) + '\n'
+
+
+def buffered(pieces, size):
+    """Joins pieces of a response into chunks of at least size characters (so
+    a large export isn't sent a few bytes at a time)."""
+    buffer = []
+    length = 0
+    for piece in pieces:
+        buffer.append(piece)
+        length += len(piece)
+        if length >= size:
+            yield ''.join(buffer)
+            buffer = []
+            length = 0
+    if buffer:
+        yield ''.join(buffer)
@@ -0,0 +1,156 @@
+# Local verification of Google ID tokens. Instead of asking Google's API about
+# every sign-in, the ID token's signature is checked against Google's public
+# signing keys, and its audience, issuer, and expiry are checked here. The
+# keys are fetched once and cached for as long as the Cache-Control header
+# they're served with allows (or loaded from a local file, for testing).
+
+import base64
+import json
+import re
+import threading
+import time
+
+import rsa
+
+# Issuers Google uses for its ID tokens
+GOOGLE_ISSUERS = ('accounts.google.com', 'https://accounts.google.com')
+
+# Number of seconds of clock difference tolerated when checking timestamps
+CLOCK_SKEW = 300
+
+# Minimum number of seconds between fetches of the keys prompted by tokens
+# signed with an unknown key (so bogus tokens can't cause a fetch each)
+MIN_REFRESH_INTERVAL = 60
+
+
+class IDTokenError(Exception):
+    """Raised when an ID token can't be verified."""
+
+
+def _b64decode(segment):
+    """Decodes a base64url string (with or without padding)."""
+    if isinstance(segment, str):
+        segment = segment.encode('ascii')
+    return base64.urlsafe_b64decode(segment + b'=' * (-len(segment) % 4))
+
+
+def _b64int(segment):
+    """Decodes a base64url string holding a big-endian integer."""
+    return int.from_bytes(_b64decode(segment), 'big')
+
+
+class GoogleKeySet(object):
+    """Google's ID token signing keys (a JSON Web Key Set), cached in memory.
+    The keys are fetched with the supplied HTTP client from the URL returned
+    by get_url, unless a key set is loaded from a file instead."""
+
+    def __init__(self, http, get_url, keys_file=None):
+        self.http = http
+        self.get_url = get_url
+        self._lock = threading.Lock()
+        self._keys = {}
+        self._expires = 0
+        self._fetched_at = None
+        self._from_file = bool(keys_file)
+        if keys_file:
+            with open(keys_file, 'r') as jwks_file:
+                self.set_keys(json.load(jwks_file), max_age=float('inf'))
+
+    def set_keys(self, jwks, max_age):
+        """Replaces the cached keys with those in a JSON Web Key Set, keeping
+        them for max_age seconds."""
+        keys = {}
+        for jwk in jwks.get('keys', []):
+            if jwk.get('kty') == 'RSA':
+                keys[jwk['kid']] = rsa.PublicKey(
+                    _b64int(jwk['n']), _b64int(jwk['e']))
+        self._keys = keys
+        self._expires = time.monotonic() + max_age
+
+    def _fetch(self):
+        """Fetches the keys, caching them according to the response's
+        Cache-Control max-age directive."""
+        self._fetched_at = time.monotonic()
+        response = self.http.get(self.get_url())
+        response.raise_for_status()
+        match = re.search(
+            r'max-age=(\d+)', response.headers.get('Cache-Control', ''))
+        self.set_keys(response.json(), int(match.group(1)) if match else 0)
+
+    def get_key(self, key_id):
+        """Returns the public key with the supplied ID. The keys are fetched
+        again once they've expired, or if the ID is unknown (which happens
+        after Google rotates its keys). If fetching them fails, the cached
+        keys are kept and used."""
+        with self._lock:
+            now = time.monotonic()
+            expired = now >= self._expires
+            unknown = key_id not in self._keys and (
+                self._fetched_at is None or
+                now - self._fetched_at >= MIN_REFRESH_INTERVAL)
+            if not self._from_file and (expired or unknown):
+                try:
+                    self._fetch()
+                except Exception as e:
+                    if key_id not in self._keys:
+                        raise IDTokenError(
+                            'Failed to fetch signing keys ({!r})'.format(e))
+        try:
+            return self._keys[key_id]
+        except KeyError:
+            raise IDTokenError('Unknown signing key: {}'.format(key_id))
+
+
+def verify_id_token(token, client_id, key_set):
+    """Verifies a Google ID token's signature, audience, issuer, and expiry,
+    and that its email address has been verified. Returns the token's
+    claims, or raises IDTokenError."""
+
+    # Split the token into its header, payload, and signature
+    try:
+        header_segment, payload_segment, signature_segment = token.split('.')
+        header = json.loads(_b64decode(header_segment).decode('utf-8'))
+        claims = json.loads(_b64decode(payload_segment).decode('utf-8'))
+        signature = _b64decode(signature_segment)
+    except (AttributeError, ValueError) as e:
+        raise IDTokenError('Malformed ID token ({!r})'.format(e))
+    if not isinstance(header, dict) or not isinstance(claims, dict):
+        raise IDTokenError('Malformed ID token')
+
+    # Check the signature (which must be an RSA signature of a SHA-256 hash)
+    if header.get('alg') != 'RS256':
+        raise IDTokenError(
+            'Unexpected algorithm: {}'.format(header.get('alg')))
+    key = key_set.get_key(header.get('kid'))
+    signed = '{}.{}'.format(header_segment, payload_segment).encode('ascii')
+    try:
+        hash_method = rsa.verify(signed, signature, key)
+    except rsa.VerificationError:
+        raise IDTokenError('Invalid signature')
+    if hash_method != 'SHA-256':
+        raise IDTokenError('Unexpected hash method: {}'.format(hash_method))
+
+    # Make sure the token was issued by Google, for this application
+    if claims.get('aud') != client_id:
+        raise IDTokenError('Client ID mismatch')
+    if claims.get('iss') not in GOOGLE_ISSUERS:
+        raise IDTokenError('Unexpected issuer: {}'.format(claims.get('iss')))
+
+    # Make sure the token is currently valid
+    now = time.time()
+    try:
+        issued_at = float(claims['iat'])
+        expires_at = float(claims['exp'])
+    except (KeyError, TypeError, ValueError):
+        raise IDTokenError('Missing or invalid timestamps')
+    if issued_at > now + CLOCK_SKEW:
+        raise IDTokenError('Token used too early')
+    if expires_at < now - CLOCK_SKEW:
+        raise IDTokenError('Token expired')
+
+    # Make sure the user's email address has been verified by Google (the
+    # claim may be a boolean or a string)
+    if str(claims.get('email_verified')).lower() != 'true':
+        raise IDTokenError('Email address not verified')
+
+    return claims
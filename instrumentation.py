@@ -0,0 +1,273 @@
+# Opt-in instrumentation of requests, for finding out why a page is slow. For
+# each request, the SQL statements run (and the time spent running them), the
+# time spent rendering templates, and the time spent waiting on the
+# authentication providers are recorded. They're reported in a Server-Timing
+# response header and a JSON log line, and aggregated per route into metrics
+# served at /metrics (in Prometheus's text format). The metrics are kept in
+# memory, so each worker process serves its own.
+
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+from flask import g, has_request_context, request
+from flask import before_render_template, template_rendered
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Upper bounds (in seconds) of the request latency histogram's buckets
+LATENCY_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, float('inf'))
+
+# Kinds of work timed during a request (reported in this order)
+KINDS = ('db', 'render', 'provider')
+
+
+class RequestTimings(object):
+    """The number of SQL statements run during a request, and the time spent
+    on each kind of work."""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.queries = 0
+        self.durations = dict.fromkeys(KINDS, 0.0)
+
+
+def current_timings():
+    """Returns the timings of the current request, or None if there's no
+    request (or it isn't being instrumented)."""
+    if has_request_context():
+        return g.get('request_timings')
+    return None
+
+
+@contextmanager
+def timed(kind):
+    """Adds the time spent in the with block to the current request's timings
+    (if it's being instrumented)."""
+    timings = current_timings()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        if timings is not None:
+            timings.durations[kind] += time.perf_counter() - start
+
+
+# Time every SQL statement run by any engine (the start times are kept on the
+# connection, as a stack).
+def _before_cursor_execute(connection, cursor, statement, parameters, context,
+                           executemany):
+    connection.info.setdefault('query_start', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(connection, cursor, statement, parameters, context,
+                          executemany):
+    start = connection.info['query_start'].pop()
+    timings = current_timings()
+    if timings is not None:
+        timings.queries += 1
+        timings.durations['db'] += time.perf_counter() - start
+
+
+def _handle_error(exception_context):
+    # A statement that fails never reaches after_cursor_execute, so drop its
+    # start time here (connection errors have no connection, or no start time)
+    connection = exception_context.connection
+    if connection is not None and connection.info.get('query_start'):
+        connection.info['query_start'].pop()
+
+
+# Time template rendering (the start times are kept on the request, as a stack)
+def _render_started(sender, template, context, **extra):
+    if current_timings() is not None:
+        g.setdefault('render_start', []).append(time.perf_counter())
+
+
+def _render_finished(sender, template, context, **extra):
+    timings = current_timings()
+    if timings is not None and g.get('render_start'):
+        timings.durations['render'] += (
+            time.perf_counter() - g.render_start.pop())
+
+
+def _escape(value):
+    """Escapes a Prometheus label value."""
+    return (str(value).replace('\\', '\\\\').replace('"', '\\"')
+            .replace('\n', '\\n'))
+
+
+class RouteMetrics(object):
+    """Aggregates request timings per route (and method)."""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._routes = {}
+        self._statuses = {}
+
+    def observe(self, route, method, status, duration, timings):
+        """Records a finished request."""
+        with self._lock:
+            metrics = self._routes.get((route, method))
+            if metrics is None:
+                metrics = self._routes[(route, method)] = {
+                    'buckets': [0] * len(self.buckets),
+                    'count': 0,
+                    'sum': 0.0,
+                    'queries': 0,
+                    'durations': dict.fromkeys(KINDS, 0.0)}
+            for i, bound in enumerate(self.buckets):
+                if duration <= bound:
+                    metrics['buckets'][i] += 1
+            metrics['count'] += 1
+            metrics['sum'] += duration
+            metrics['queries'] += timings.queries
+            for kind in KINDS:
+                metrics['durations'][kind] += timings.durations[kind]
+
+            key = (route, method, status)
+            self._statuses[key] = self._statuses.get(key, 0) + 1
+
+    def render(self):
+        """Returns the metrics in Prometheus's text exposition format."""
+        lines = []
+        with self._lock:
+            routes = sorted(self._routes.items())
+            statuses = sorted(self._statuses.items())
+
+            lines.append(
+                '# HELP catalog_requests_total Requests handled, by route, '
+                'method, and status.')
+            lines.append('# TYPE catalog_requests_total counter')
+            for (route, method, status), count in statuses:
+                lines.append(
+                    'catalog_requests_total{{route="{}",method="{}",'
+                    'status="{}"}} {}'.format(
+                        _escape(route), method, status, count))
+
+            lines.append(
+                '# HELP catalog_request_duration_seconds Time taken to '
+                'handle requests.')
+            lines.append('# TYPE catalog_request_duration_seconds histogram')
+            for (route, method), metrics in routes:
+                labels = 'route="{}",method="{}"'.format(
+                    _escape(route), method)
+                for bound, count in zip(self.buckets, metrics['buckets']):
+                    lines.append(
+                        'catalog_request_duration_seconds_bucket'
+                        '{{{},le="{}"}} {}'.format(
+                            labels, '+Inf' if bound == float('inf') else
+                            bound, count))
+                lines.append('catalog_request_duration_seconds_sum{{{}}} '
+                             '{}'.format(labels, metrics['sum']))
+                lines.append('catalog_request_duration_seconds_count{{{}}} '
+                             '{}'.format(labels, metrics['count']))
+
+            lines.append(
+                '# HELP catalog_request_db_queries_total SQL statements run '
+                'while handling requests.')
+            lines.append('# TYPE catalog_request_db_queries_total counter')
+            for (route, method), metrics in routes:
+                lines.append(
+                    'catalog_request_db_queries_total{{route="{}",'
+                    'method="{}"}} {}'.format(
+                        _escape(route), method, metrics['queries']))
+
+            for kind, description in (
+                    ('db', 'running SQL statements'),
+                    ('render', 'rendering templates'),
+                    ('provider', 'waiting on authentication providers')):
+                name = 'catalog_request_{}_seconds_total'.format(kind)
+                lines.append('# HELP {} Time spent {} while handling '
+                             'requests.'.format(name, description))
+                lines.append('# TYPE {} counter'.format(name))
+                for (route, method), metrics in routes:
+                    lines.append('{}{{route="{}",method="{}"}} {}'.format(
+                        name, _escape(route), method,
+                        metrics['durations'][kind]))
+
+        return '\n'.join(lines) + '\n'
+
+
+class Instrumentation(object):
+    """Instruments an app's requests, and adds a /metrics route to it."""
+
+    def __init__(self, app, log=True):
+        self.app = app
+        self.log = log
+        self.metrics = RouteMetrics()
+
+        # Requests are logged at the INFO level, which Flask's logger doesn't
+        # show by default (unless it's been given a level)
+        if log and app.logger.level == logging.NOTSET:
+            app.logger.setLevel(logging.INFO)
+
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+        event.listen(Engine, 'handle_error', _handle_error)
+        before_render_template.connect(_render_started, app)
+        template_rendered.connect(_render_finished, app)
+
+        app.before_request(self._start_request)
+        app.after_request(self._finish_request)
+        app.add_url_rule('/metrics', 'metrics', self.show_metrics)
+
+    def instrument_client(self, http):
+        """Times the requests made by an HTTP client (such as the provider
+        HTTP client) as provider work. Requests made concurrently are timed
+        together, from the calling thread."""
+        for name in ('get', 'get_json_concurrently'):
+            setattr(http, name, self._timed_call(getattr(http, name)))
+
+    @staticmethod
+    def _timed_call(method):
+        @wraps(method)
+        def timed_method(*args, **kwargs):
+            with timed('provider'):
+                return method(*args, **kwargs)
+        return timed_method
+
+    def _start_request(self):
+        g.request_timings = RequestTimings()
+
+    def _finish_request(self, response):
+        timings = g.pop('request_timings', None)
+        if timings is None:
+            return response
+        duration = time.perf_counter() - timings.start
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+
+        # Report the timings to the browser (as seen in its developer tools)
+        response.headers['Server-Timing'] = ', '.join(
+            ['db;dur={:.2f};desc="{} queries"'.format(
+                timings.durations['db'] * 1000, timings.queries)] +
+            ['{};dur={:.2f}'.format(kind, timings.durations[kind] * 1000)
+             for kind in KINDS[1:]] +
+            ['total;dur={:.2f}'.format(duration * 1000)])
+
+        # Log the request
+        if self.log:
+            self.app.logger.info(json.dumps({
+                'method': request.method,
+                'path': request.full_path.rstrip('?'),
+                'route': route,
+                'status': response.status_code,
+                'duration_ms': round(duration * 1000, 2),
+                'db_queries': timings.queries,
+                'db_ms': round(timings.durations['db'] * 1000, 2),
+                'render_ms': round(timings.durations['render'] * 1000, 2),
+                'provider_ms': round(timings.durations['provider'] * 1000, 2)
+            }))
+
+        self.metrics.observe(
+            route, request.method, response.status_code, duration, timings)
+        return response
+
+    def show_metrics(self):
+        return self.app.response_class(
+            self.metrics.render(),
+            content_type='text/plain; version=0.0.4; charset=utf-8')
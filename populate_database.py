@@ -1,14 +1,31 @@
 #!/usr/bin/env python3
 #
 # Sample data for populating the item catalog database. Adds a user and items.
+# Can also bulk load items (from a JSON, JSON Lines, or CSV file, or generated
+# synthetically) for building large databases for load testing:
+#
+#   python3 populate_database.py --file items.jsonl
+#   python3 populate_database.py --synthetic 1000000 --batch-size 50000
+
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+from datetime import datetime
 
-from sqlalchemy import create_engine
+from sqlalchemy import select, update
 from sqlalchemy.orm import sessionmaker
 
-from database_setup import Base, User, Item
+from database_setup import Base, User, Category, Item, CatalogState
+from database_setup import make_slug, make_summary, bump_catalog_version
+from database_setup import bump_category_versions
+from storage import get_engines
 
-# Connect to the database and bind the engine to the Base class
-engine = create_engine('sqlite:///catalog.db')
+# Connect to the database (through its writer engine) and bind the engine to
+# the Base class
+engine = get_engines().writer
 Base.metadata.bind = engine
 
 # Create a session
@@ -28,7 +45,6 @@ def addSampleData():
             'https://pbs.twimg.com/profile_images/2671170543/'
             '18debd694829ed78203a5a36dd364160_400x400.png'))
     session.add(user1)
-    session.commit()
 
     # Add an item to the Chinese category
     item1 = Item(
@@ -52,7 +68,6 @@ def addSampleData():
             'https://steamykitchen.com/wp-content/uploads/2008/08/'
             'image_2144web2.jpg'))
     session.add(item1)
-    session.commit()
 
     # Add an item to the Japanese category
     item2 = Item(
@@ -75,7 +90,6 @@ def addSampleData():
             'https://japancentre-images.freetls.fastly.net/recipes/pics/733/'
             'main/733-udon-noodles.jpg'))
     session.add(item2)
-    session.commit()
 
     # Add an item to the Korean category
     item3 = Item(
@@ -96,7 +110,6 @@ def addSampleData():
             'http://www.futuredish.com/wp-content/uploads/2017/02/'
             'Janchi-Guksu.png'))
     session.add(item3)
-    session.commit()
 
     # Add an item to the Thai category
     item4 = Item(
@@ -119,7 +132,6 @@ def addSampleData():
             'https://www.saveur.com/sites/saveur.com/files/styles/medium_1x_/'
             'public/thaiboatnoodlesoup_2000x1500.jpg?itok=OKdjcIuA'))
     session.add(item4)
-    session.commit()
 
     # Add an item to the Vietnamese category
     item5 = Item(
@@ -147,7 +159,6 @@ def addSampleData():
             'vd=20171018T134637Z&hash='
             '7D6E1C193DFC641586A7E9A45B11FA048D42542F'))
     session.add(item5)
-    session.commit()
 
     # Add an item to the Other category
     item6 = Item(
@@ -170,7 +181,6 @@ def addSampleData():
             'https://i1.wp.com/angsarap.net/wp-content/uploads/2014/12/'
             'Penang-Prawn-Mee-Wide.jpg'))
     session.add(item6)
-    session.commit()
 
     # Add another item to the Japanese category
     item7 = Item(
@@ -188,7 +198,6 @@ def addSampleData():
             'https://www.williams-sonoma.com/wsimgs/rk/images/dp/recipe/'
             '201707/0063/img97l.jpg'))
     session.add(item7)
-    session.commit()
 
     # Add another item to the Other category
     item8 = Item(
@@ -205,12 +214,178 @@ def addSampleData():
             'https://i2.wp.com/themacadames.com/wp-content/uploads/2014/07/'
             'Laksa-Lead-image.jpg'))
     session.add(item8)
+
+    # Record the change to the catalog
+    bump_catalog_version(session)
+    bump_category_versions(session)
     session.commit()
 
     print('Sample data added!')
 
-# Populate the database with sample data (if it hasn't already been added)
-if session.query(User).filter_by(email='roboadmin@email.com').first() is None:
-    addSampleData()
-else:
-    print('Error. Sample data has already been added.')
+# Number of items inserted per transaction by the bulk loader
+DEFAULT_BATCH_SIZE = 10000
+
+
+def read_items(path):
+    """Yields item records (dicts) read from a JSON, JSON Lines, or CSV file.
+    A JSON file must hold a list of objects."""
+    extension = os.path.splitext(path)[1].lower()
+    if extension == '.json':
+        with open(path, 'r', encoding='utf-8') as items_file:
+            records = json.load(items_file)
+        if not isinstance(records, list):
+            raise ValueError('{}: expected a list of items'.format(path))
+        yield from records
+    elif extension in ('.jsonl', '.ndjson'):
+        with open(path, 'r', encoding='utf-8') as items_file:
+            for line in items_file:
+                if line.strip():
+                    yield json.loads(line)
+    elif extension == '.csv':
+        with open(path, 'r', encoding='utf-8', newline='') as items_file:
+            yield from csv.DictReader(items_file)
+    else:
+        raise ValueError('{}: unsupported file type'.format(path))
+
+
+def synthetic_items(count, category_ids):
+    """Yields count synthetic item records, spread evenly across the
+    categories with the supplied IDs."""
+    for i in range(count):
+        yield {
+            'cat_id': category_ids[i % len(category_ids)],
+            'name': 'Noodles {}'.format(i),
+            'description': 'Synthetic noodles number {}. '.format(i) * 4,
+            'image_url': 'https://example.com/{}.jpg'.format(i)}
+
+
+def item_row(record, user_id, category_ids, known_ids):
+    """Converts an item record into a row for the Item table. The record's
+    category is given either by ID (cat_id) or by name (category), which is
+    looked up in category_ids."""
+    name = record.get('name')
+    if not name:
+        raise ValueError('Item has no name: {!r}'.format(record))
+    if record.get('cat_id'):
+        cat_id = int(record['cat_id'])
+    else:
+        cat_id = category_ids.get(str(record.get('category', '')).lower())
+    if cat_id not in known_ids:
+        raise ValueError('Item has an unknown category: {!r}'.format(record))
+    description = record.get('description') or ''
+    return {
+        'user_id': user_id,
+        'cat_id': cat_id,
+        'name': name,
+        'slug': make_slug(name),
+        'description': description,
+        'summary': make_summary(description),
+        'image_url': record.get('image_url') or ''}
+
+
+def insert_batch(connection, batch):
+    """Inserts a batch of item rows, incrementing the catalog's version and
+    the versions of the batch's categories in the same transaction (so the
+    versions are current however many batches end up committed)."""
+    connection.execute(Item.__table__.insert(), batch)
+    connection.execute(
+        update(CatalogState.__table__)
+        .where(CatalogState.id == 1)
+        .values(version=CatalogState.version + 1,
+                modified=datetime.utcnow()))
+    connection.execute(
+        update(Category.__table__)
+        .where(Category.id.in_(set(row['cat_id'] for row in batch)))
+        .values(version=Category.version + 1))
+
+
+def bulk_load_items(engine, records, user_id, batch_size=DEFAULT_BATCH_SIZE):
+    """Inserts item records owned by a user, batch_size rows at a time with
+    one executemany() per transaction. Returns the number of items added."""
+
+    with engine.connect() as connection:
+        category_ids = {
+            name.lower(): cat_id for cat_id, name in connection.execute(
+                select(Category.id, Category.name))}
+    known_ids = set(category_ids.values())
+
+    added = 0
+    batch = []
+    for record in records:
+        batch.append(item_row(record, user_id, category_ids, known_ids))
+        if len(batch) >= batch_size:
+            with engine.begin() as connection:
+                insert_batch(connection, batch)
+            added += len(batch)
+            batch = []
+    if batch:
+        with engine.begin() as connection:
+            insert_batch(connection, batch)
+        added += len(batch)
+
+    return added
+
+
+def get_owner_id(email):
+    """Returns the ID of the user with the supplied email, adding the user if
+    they don't exist."""
+    user = session.query(User).filter_by(email=email).first()
+    if user is None:
+        user = User(name=email.split('@')[0], email=email)
+        session.add(user)
+        session.commit()
+    return user.id
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Populates the item catalog database. Adds the sample '
+                    'data, or bulk loads items from a file or generated '
+                    'synthetically.')
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument(
+        '--file', help='load items from a JSON, JSON Lines, or CSV file')
+    source.add_argument(
+        '--synthetic', type=int, metavar='N',
+        help='generate N synthetic items')
+    parser.add_argument(
+        '--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+        help='items inserted per transaction (default: %(default)s)')
+    parser.add_argument(
+        '--owner', default='roboadmin@email.com',
+        help='email of the user who owns bulk loaded items '
+             '(default: %(default)s)')
+    args = parser.parse_args()
+
+    # Populate the database with sample data (if it hasn't already been added)
+    if args.file is None and args.synthetic is None:
+        if session.query(User).filter_by(
+                email='roboadmin@email.com').first() is None:
+            addSampleData()
+        else:
+            print('Error. Sample data has already been added.')
+        return
+
+    if args.file is not None:
+        records = read_items(args.file)
+    else:
+        records = synthetic_items(args.synthetic, [
+            cat_id for cat_id, in session.query(Category.id)])
+
+    # End the session's transaction before loading, since the load needs the
+    # (single) writer connection that the session would otherwise hold
+    owner_id = get_owner_id(args.owner)
+    session.commit()
+
+    start = time.perf_counter()
+    try:
+        added = bulk_load_items(engine, records, owner_id, args.batch_size)
+    except (OSError, ValueError) as e:
+        sys.exit('Error. {}'.format(e))
+
+    print('Added {} items in {:.1f}s'.format(
+        added, time.perf_counter() - start))
+
+
+if __name__ == '__main__':
+    main()
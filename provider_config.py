@@ -0,0 +1,98 @@
+# Configuration for the authentication providers (Google and Facebook), read
+# from their client secret files. Each file is parsed and validated once, and
+# only read again when it changes on disk (or when a reload is requested, such
+# as on SIGHUP).
+
+import json
+import os
+import threading
+from collections import namedtuple
+
+from oauth2client import clientsecrets
+
+# Settings needed to exchange a Google authorization code for credentials
+GoogleConfig = namedtuple(
+    'GoogleConfig', ['client_id', 'client_secret', 'auth_uri', 'token_uri'])
+
+# Settings needed to exchange a Facebook access token for a long-lived token
+FacebookConfig = namedtuple('FacebookConfig', ['app_id', 'app_secret'])
+
+
+class ProviderConfigError(Exception):
+    """Raised when a provider's client secret file is missing or invalid."""
+
+
+def load_google_config(path):
+    """Parses and validates a Google client secret file."""
+    try:
+        client_type, client_info = clientsecrets.loadfile(path)
+    except (clientsecrets.InvalidClientSecretsError, OSError, ValueError) as e:
+        raise ProviderConfigError('{}: {!r}'.format(path, e))
+    if client_type != clientsecrets.TYPE_WEB:
+        raise ProviderConfigError(
+            '{}: expected a "web" client, not "{}"'.format(path, client_type))
+    return GoogleConfig(
+        client_info['client_id'], client_info['client_secret'],
+        client_info['auth_uri'], client_info['token_uri'])
+
+
+def load_facebook_config(path):
+    """Parses and validates a Facebook client secret file."""
+    try:
+        with open(path, 'r') as secret_file:
+            web = json.load(secret_file)['web']
+        return FacebookConfig(str(web['app_id']), str(web['app_secret']))
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        raise ProviderConfigError('{}: {!r}'.format(path, e))
+
+
+class ProviderConfig(object):
+    """Holds the parsed contents of a client secret file. The file is parsed
+    again only when its modification time changes, or after reload() has
+    been called."""
+
+    def __init__(self, path, loader):
+        self.path = path
+        self.loader = loader
+        self._lock = threading.Lock()
+        self._mtime = None
+        self._config = None
+        self._error = None
+        self._reload_requested = False
+        self._load()
+
+    def _load(self):
+        """Parses the file, remembering the config (or the error raised)."""
+        try:
+            self._mtime = os.stat(self.path).st_mtime
+        except OSError:
+            self._mtime = None
+        try:
+            self._config = self.loader(self.path)
+            self._error = None
+        except ProviderConfigError as e:
+            print('Invalid provider configuration ({})'.format(e))
+            self._config = None
+            self._error = e
+
+    def reload(self):
+        """Requests that the file be parsed again on next use. Only sets a
+        flag, so it's safe to call from a signal handler."""
+        self._reload_requested = True
+
+    def get(self):
+        """Returns the current config, raising ProviderConfigError if the
+        file is missing or invalid."""
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except OSError:
+            mtime = None
+
+        if self._reload_requested or mtime != self._mtime:
+            with self._lock:
+                self._reload_requested = False
+                self._load()
+
+        if self._error is not None:
+            raise self._error
+        return self._config
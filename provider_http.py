@@ -0,0 +1,75 @@
+# A shared HTTP client for calls to the authentication providers (Google and
+# Facebook). Connections are pooled and kept alive between logins, so most
+# calls skip the TCP and TLS handshakes. Every request has connect and read
+# timeouts, and failed requests are retried a bounded number of times.
+# Independent requests can be made concurrently on a small thread pool.
+#
+# requests.Session isn't documented as thread-safe (its cookie jar, for one,
+# is shared state), so each thread gets its own session. The sessions all
+# use one HTTPAdapter, whose urllib3 connection pools are thread-safe, so
+# connections are still shared between threads.
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+class ProviderHTTPClient(object):
+    """Makes GET requests to the providers' APIs over pooled connections."""
+
+    def __init__(self, pool_size, connect_timeout, read_timeout, retries,
+                 backoff_factor, workers):
+        self.timeout = (connect_timeout, read_timeout)
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+
+        # Retry failed connections, reads, and temporary server errors (with
+        # an exponential backoff between attempts). If the retries run out on
+        # a server error, its response is returned as usual.
+        retry = Retry(
+            total=retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=(500, 502, 503, 504),
+            allowed_methods=frozenset(['GET']),
+            raise_on_status=False)
+        self.adapter = HTTPAdapter(
+            pool_connections=pool_size, pool_maxsize=pool_size,
+            max_retries=retry)
+        self._local = threading.local()
+
+    @property
+    def session(self):
+        """The calling thread's session (created on first use)."""
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = self._local.session = requests.Session()
+            session.mount('https://', self.adapter)
+            session.mount('http://', self.adapter)
+        return session
+
+    def get(self, url, params=None):
+        """Makes a GET request and returns the response."""
+        return self.session.get(url, params=params, timeout=self.timeout)
+
+    def get_json(self, url, params=None):
+        """Makes a GET request and returns the decoded JSON response."""
+        return self.get(url, params=params).json()
+
+    def get_json_concurrently(self, *calls):
+        """Makes several GET requests at the same time. Each request is given
+        as a (url, params) pair. Returns a list holding the decoded JSON
+        response to each request, or the exception raised while making it,
+        in the order the requests were given."""
+        futures = [
+            self.executor.submit(self.get_json, url, params)
+            for url, params in calls]
+
+        results = []
+        for future in futures:
+            try:
+                results.append(future.result())
+            except Exception as e:
+                results.append(e)
+        return results
@@ -0,0 +1,48 @@
+# Counts the SQL statements executed by one or more engines. Useful for making
+# sure a page runs a constant number of queries, no matter how many items it
+# lists.
+
+from contextlib import contextmanager
+
+from sqlalchemy import event
+
+
+class QueryCounter(object):
+    """Records the SQL statements executed by one or more engines while the
+    counter is active (used as a context manager)."""
+
+    def __init__(self, *engines):
+        self.engines = set(engines)
+        self.statements = []
+
+    def _record(self, connection, cursor, statement, parameters, context,
+                executemany):
+        self.statements.append(statement)
+
+    def __enter__(self):
+        for engine in self.engines:
+            event.listen(engine, 'before_cursor_execute', self._record)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        for engine in self.engines:
+            event.remove(engine, 'before_cursor_execute', self._record)
+
+    @property
+    def count(self):
+        """The number of statements executed so far."""
+        return len(self.statements)
+
+
+@contextmanager
+def assert_query_count(*engines, expected):
+    """Raises an AssertionError if the code run inside the with block doesn't
+    execute exactly the expected number of SQL statements (on any of the
+    engines, such as a database's reader and writer)."""
+    with QueryCounter(*engines) as counter:
+        yield counter
+
+    if counter.count != expected:
+        raise AssertionError(
+            'Expected {} SQL statements, but {} were executed:\n{}'.format(
+                expected, counter.count, '\n'.join(counter.statements)))
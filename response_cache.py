@@ -0,0 +1,173 @@
+# A cache of rendered pages, so that anonymous visitors can be served popular
+# pages without any database or template work. Each cached page is tagged
+# with the parts of the catalog it shows (such as a category or an item), and
+# changes to the catalog invalidate just the tags they affect.
+#
+# Invalidation works by versioning tags rather than by finding and deleting
+# pages. A page is stored along with the versions its tags had before it was
+# rendered, and it's only served while all of those versions are current.
+
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+
+
+class MemoryBackend(object):
+    """Stores cached pages in memory. Once max_entries pages are stored, the
+    least recently used page is discarded to make room for each new one."""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._tag_versions = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def set(self, key, entry):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def tag_version(self, tag):
+        return self._tag_versions.get(tag, 0)
+
+    def bump_tag(self, tag):
+        with self._lock:
+            self._tag_versions[tag] = self._tag_versions.get(tag, 0) + 1
+
+
+class FileSystemBackend(object):
+    """Stores cached pages as files in a directory, so that they can be shared
+    by several worker processes. Once there are more than max_entries pages,
+    the least recently stored ones are deleted.
+
+    The directory is only readable by the user running the app, and isn't
+    used if it belongs to another user. Each page is stored as a line of
+    JSON (holding its mimetype and tag versions) followed by its body, so
+    reading one never runs any code."""
+
+    def __init__(self, directory, max_entries):
+        self.directory = directory
+        self.max_entries = max_entries
+        self._pages_directory = os.path.join(directory, 'pages')
+        self._tags_directory = os.path.join(directory, 'tags')
+        for path in (directory, self._pages_directory, self._tags_directory):
+            os.makedirs(path, mode=0o700, exist_ok=True)
+            if hasattr(os, 'getuid') and os.stat(path).st_uid != os.getuid():
+                raise PermissionError(
+                    'Page cache directory {} belongs to another user'
+                    .format(path))
+
+    @staticmethod
+    def _filename(name):
+        """Returns a filesystem-safe file name for a key or tag."""
+        return hashlib.sha1(name.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        path = os.path.join(self._pages_directory, self._filename(key))
+        try:
+            with open(path, 'rb') as page_file:
+                header = json.loads(page_file.readline().decode('utf-8'))
+                return (page_file.read(), header['mimetype'],
+                        header['tag_versions'])
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+
+    def set(self, key, entry):
+        # Write the page to a temporary file first and then move it into
+        # place, so other processes never read a partially written page.
+        body, mimetype, tag_versions = entry
+        header = json.dumps(
+            {'mimetype': mimetype, 'tag_versions': tag_versions})
+        descriptor, temp_path = tempfile.mkstemp(dir=self.directory)
+        with os.fdopen(descriptor, 'wb') as page_file:
+            page_file.write(header.encode('utf-8') + b'\n')
+            page_file.write(body)
+        os.replace(temp_path, os.path.join(
+            self._pages_directory, self._filename(key)))
+        self._prune()
+
+    def _prune(self):
+        """Deletes the oldest pages once there are more than max_entries."""
+        pages = list(os.scandir(self._pages_directory))
+        if len(pages) <= self.max_entries:
+            return
+        pages.sort(key=lambda page: page.stat().st_mtime)
+        for page in pages[:len(pages) - self.max_entries]:
+            try:
+                os.remove(page.path)
+            except OSError:
+                pass
+
+    # A tag's version is the size of its file. Bumping a tag appends a byte to
+    # the file, which is atomic across processes (thanks to O_APPEND).
+    def tag_version(self, tag):
+        try:
+            return os.stat(os.path.join(
+                self._tags_directory, self._filename(tag))).st_size
+        except OSError:
+            return 0
+
+    def bump_tag(self, tag):
+        descriptor = os.open(
+            os.path.join(self._tags_directory, self._filename(tag)),
+            os.O_WRONLY | os.O_CREAT | os.O_APPEND)
+        try:
+            os.write(descriptor, b'.')
+        finally:
+            os.close(descriptor)
+
+
+class ResponseCache(object):
+    """Caches rendered pages by key, invalidating them by tag."""
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    def tag_versions(self, tags):
+        """Returns the current versions of the supplied tags. They should be
+        read before a page is rendered, and then stored along with it."""
+        return {tag: self.backend.tag_version(tag) for tag in tags}
+
+    def get(self, key):
+        """Returns the cached (body, mimetype) of a page, or None if the page
+        isn't cached or has been invalidated."""
+        entry = self.backend.get(key)
+        if entry is None:
+            return None
+        body, mimetype, tag_versions = entry
+        if tag_versions != self.tag_versions(tag_versions):
+            return None
+        return body, mimetype
+
+    def set(self, key, tag_versions, body, mimetype):
+        """Caches a page along with the tag versions it was rendered with."""
+        self.backend.set(key, (body, mimetype, tag_versions))
+
+    def invalidate(self, tags):
+        """Invalidates every cached page tagged with any of the tags."""
+        for tag in set(tags):
+            self.backend.bump_tag(tag)
+
+
+def create_response_cache(backend, max_entries, directory):
+    """Returns a ResponseCache using the named backend ('memory' or
+    'filesystem'), or None if the backend is 'none'."""
+    if backend == 'memory':
+        return ResponseCache(MemoryBackend(max_entries))
+    if backend == 'filesystem':
+        return ResponseCache(FileSystemBackend(directory, max_entries))
+    if backend == 'none':
+        return None
+    raise ValueError('Unknown response cache backend: {}'.format(backend))
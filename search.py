@@ -0,0 +1,89 @@
+# Full-text search over item names and descriptions. On SQLite, the items are
+# indexed in an FTS5 table (item_fts, created in database_setup.py) that
+# triggers keep in step with the item table, so a search only reads the index
+# entries for its terms. Matches are ranked with bm25 (with a match in an
+# item's name counting for more than one in its description), although only
+# the newest SEARCH_MAX_RESULTS matches are ranked (and the search is marked
+# as truncated when there are more). Other databases fall back to scanning
+# the items with LIKE, newest first.
+
+import re
+
+from sqlalchemy import and_, desc, func, literal_column, or_, select
+from sqlalchemy.sql import column, table
+
+import config
+from database_setup import Item
+
+# Weights given to matches in an item's name and description when ranking
+NAME_WEIGHT = 10.0
+DESCRIPTION_WEIGHT = 1.0
+
+# A search term: a run of letters and digits, optionally followed by a *
+TERM_PATTERN = re.compile(r'(\w+)(\*?)')
+
+
+def parse_terms(query):
+    """Returns the terms in a search query, as (term, is_prefix) pairs. A term
+    followed by a * is a prefix, and so is the last term (so that results
+    can be shown while the query is being typed)."""
+    terms = [
+        (term, bool(star)) for term, star in TERM_PATTERN.findall(query)]
+    if terms:
+        terms[-1] = (terms[-1][0], True)
+    return terms
+
+
+def match_expression(terms):
+    """Returns an FTS5 query matching items that contain all of the terms.
+    Each term is quoted, so nothing in it is taken as FTS5 syntax."""
+    return ' '.join(
+        '"{}"{}'.format(term, '*' if is_prefix else '')
+        for term, is_prefix in terms)
+
+
+def _like_pattern(term):
+    """Returns a LIKE pattern matching a term anywhere in a column."""
+    escaped = (term.replace('\\', '\\\\').replace('%', '\\%')
+               .replace('_', '\\_'))
+    return '%' + escaped + '%'
+
+
+def search(query, terms):
+    """Filters a query of items down to those matching all of the search
+    terms, ordered with the best matches first. Returns the query, and
+    whether it was truncated to the newest SEARCH_MAX_RESULTS matches."""
+    dialect = query.session.get_bind().dialect.name
+    if dialect == 'sqlite':
+        item_fts = table('item_fts', column('rowid'))
+        fts_table = literal_column('item_fts')
+        matches = fts_table.op('MATCH')(match_expression(terms))
+
+        query = (
+            query.join(item_fts, item_fts.c.rowid == Item.id)
+            .filter(matches)
+            .order_by(func.bm25(fts_table, NAME_WEIGHT, DESCRIPTION_WEIGHT),
+                      desc(Item.id)))
+
+        # Get the IDs of the newest matches, plus one more to see if there
+        # are too many to rank (FTS5 reads matches in rowid order without
+        # ranking them, so this is cheap). If there are, only rank the
+        # matches from the oldest of those to be ranked on.
+        newest = query.session.execute(
+            select(item_fts.c.rowid).where(matches)
+            .order_by(desc(item_fts.c.rowid))
+            .limit(config.SEARCH_MAX_RESULTS + 1)).scalars().all()
+        truncated = len(newest) > config.SEARCH_MAX_RESULTS
+        if truncated:
+            query = query.filter(
+                item_fts.c.rowid >= newest[config.SEARCH_MAX_RESULTS - 1])
+        return query, truncated
+
+    # Without an index, every item's name and description has to be scanned
+    conditions = []
+    for term, _ in terms:
+        pattern = _like_pattern(term)
+        conditions.append(or_(
+            Item.name.ilike(pattern, escape='\\'),
+            Item.description.ilike(pattern, escape='\\')))
+    return query.filter(and_(*conditions)).order_by(desc(Item.id)), False
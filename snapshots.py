@@ -0,0 +1,183 @@
+# Precomputed snapshots of the JSON API's catalog and category data. The
+# snapshots are built offline (by build_snapshots.py) and stored as files,
+# along with gzip- and (if the brotli package is installed) brotli-compressed
+# copies, so the API can send them without querying the database.
+#
+# Each snapshot's file name includes the version of the data it holds (the
+# catalog's version, or the category's), so a snapshot is current exactly when
+# a file for the current version exists. Only the categories whose versions
+# have changed are rebuilt, and the catalog snapshot is pieced together from
+# the category snapshots.
+
+import gzip
+import json
+import os
+import re
+import shutil
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+from compression import ENCODINGS
+from database_setup import Category, CatalogState
+from export import category_items
+
+# Compression levels used for the compressed copies (the snapshots are built
+# offline, so the slowest, smallest settings are used)
+GZIP_LEVEL = 9
+BROTLI_QUALITY = 11
+
+# Names of the files written by the builder (including unfinished ones)
+FILE_PATTERN = re.compile(
+    r'^(catalog|category-\d+)\.v\d+\.json(\.(br|gz|tmp))*$')
+
+# Name of the catalog's snapshot
+CATALOG_NAME = 'catalog'
+
+# Size of the blocks files are copied in
+BLOCK_SIZE = 65536
+
+# The category snapshot's data is an object with a single "category" key, so
+# it can be copied into the catalog snapshot from between this prefix and
+# suffix
+CATEGORY_PREFIX = b'{"category":'
+CATEGORY_SUFFIX = b'}\n'
+
+
+def dumps(value):
+    """Serializes a value the same way as the app's jsonify()."""
+    return json.dumps(value, sort_keys=True, separators=(',', ':'))
+
+
+def category_name(category_id):
+    """Returns the name of a category's snapshot."""
+    return 'category-{}'.format(category_id)
+
+
+def snapshot_path(directory, name, version):
+    """Returns the path of a snapshot's uncompressed file."""
+    return os.path.join(directory, '{}.v{}.json'.format(name, version))
+
+
+def find_snapshot(directory, name, version, accept_encodings):
+    """Returns the path and content encoding (None if uncompressed) of the
+    file to send for a snapshot of the supplied version, picking a compressed
+    copy if the client accepts its encoding. Returns None if there's no
+    current snapshot."""
+    path = snapshot_path(directory, name, version)
+    if not os.path.exists(path):
+        return None
+    for encoding, suffix in ENCODINGS:
+        if (accept_encodings.quality(encoding) > 0 and
+                os.path.exists(path + suffix)):
+            return path + suffix, encoding
+    return path, None
+
+
+def _write_category(session, path, category, batch_size):
+    """Writes a category's snapshot (in the format of the category API
+    endpoint's response), reading its items a batch at a time."""
+    with open(path, 'w', encoding='ascii') as snapshot:
+        snapshot.write('{{"category":{{"id":{},"items":['.format(
+            dumps(category.id)))
+        for i, item in enumerate(
+                category_items(session, category, batch_size)):
+            if i:
+                snapshot.write(',')
+            snapshot.write(dumps(item.serialize()))
+        snapshot.write('],"name":{}}}}}\n'.format(dumps(category.name)))
+
+
+def _write_catalog(path, category_paths):
+    """Writes the catalog's snapshot (in the format of the catalog API
+    endpoint's response) by copying the data of the category snapshots."""
+    with open(path, 'wb') as snapshot:
+        snapshot.write(b'{"categories":[')
+        for i, category_path in enumerate(category_paths):
+            if i:
+                snapshot.write(b',')
+            remaining = (os.path.getsize(category_path) -
+                         len(CATEGORY_PREFIX) - len(CATEGORY_SUFFIX))
+            with open(category_path, 'rb') as category_snapshot:
+                category_snapshot.seek(len(CATEGORY_PREFIX))
+                while remaining > 0:
+                    block = category_snapshot.read(min(BLOCK_SIZE, remaining))
+                    snapshot.write(block)
+                    remaining -= len(block)
+        snapshot.write(b']}\n')
+
+
+def _compress(path):
+    """Writes the compressed copies of a snapshot file."""
+    with open(path, 'rb') as source, \
+            gzip.open(path + '.gz.tmp', 'wb', GZIP_LEVEL) as target:
+        shutil.copyfileobj(source, target, BLOCK_SIZE)
+    os.replace(path + '.gz.tmp', path + '.gz')
+
+    if brotli is not None:
+        compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+        with open(path, 'rb') as source, \
+                open(path + '.br.tmp', 'wb') as target:
+            for block in iter(lambda: source.read(BLOCK_SIZE), b''):
+                target.write(compressor.process(block))
+            target.write(compressor.finish())
+        os.replace(path + '.br.tmp', path + '.br')
+
+
+def _publish(path, write):
+    """Writes a snapshot to a temporary file with the supplied function,
+    compresses it, and then moves it into place (the uncompressed file is
+    moved last, since its presence marks the snapshot as complete)."""
+    write(path + '.tmp')
+    _compress(path + '.tmp')
+    for _, suffix in ENCODINGS:
+        if os.path.exists(path + '.tmp' + suffix):
+            os.replace(path + '.tmp' + suffix, path + suffix)
+    os.replace(path + '.tmp', path)
+
+
+def build_snapshots(session, directory, batch_size, force=False):
+    """Brings the snapshots in a directory up to date, rebuilding those of the
+    categories that have changed since they were built (or all of them, if
+    forced) and then the catalog's. Snapshots of earlier versions are
+    removed. Returns the number of category snapshots rebuilt."""
+    os.makedirs(directory, exist_ok=True)
+
+    # Read the catalog's version before its data, so that a change made
+    # during the build leaves the catalog snapshot out of date (rather than
+    # marking old data as current)
+    catalog_version = session.query(CatalogState).get(1).version
+    categories = session.query(Category).order_by(Category.id).all()
+
+    # Rebuild the categories' snapshots
+    current = []
+    rebuilt = 0
+    for category in categories:
+        path = snapshot_path(
+            directory, category_name(category.id), category.version)
+        if force or not os.path.exists(path):
+            _publish(path, lambda temp_path: _write_category(
+                session, temp_path, category, batch_size))
+            rebuilt += 1
+        current.append(path)
+
+    # Rebuild the catalog's snapshot
+    catalog_path = snapshot_path(directory, CATALOG_NAME, catalog_version)
+    if force or not os.path.exists(catalog_path):
+        _publish(catalog_path, lambda temp_path: _write_catalog(
+            temp_path, list(current)))
+    current.append(catalog_path)
+
+    # Remove the snapshots that are no longer current (along with any left
+    # unfinished by an earlier build)
+    keep = set()
+    for path in current:
+        keep.add(os.path.basename(path))
+        keep.update(os.path.basename(path) + suffix for _, suffix in ENCODINGS)
+    for filename in os.listdir(directory):
+        if FILE_PATTERN.match(filename) and filename not in keep:
+            os.remove(os.path.join(directory, filename))
+
+    return rebuilt
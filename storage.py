@@ -0,0 +1,141 @@
+# The database engines used by the application. Every SQLite connection is
+# tuned when it's opened: WAL journal mode (so readers carry on while a write
+# is being committed), synchronous=NORMAL (safe with WAL, and much cheaper
+# than syncing every commit), a larger page cache, memory-mapped reads, and a
+# busy timeout (so a blocked connection waits for the lock instead of failing
+# straight away).
+#
+# Reads use a pool of connections, while writes go through a single writer
+# connection. SQLite only allows one writer at a time anyway, so queueing
+# writers for that connection in the app (rather than letting them collide on
+# the database's lock) keeps writes from failing or stalling the readers.
+
+from collections import namedtuple
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.pool import QueuePool
+from sqlalchemy.sql.dml import UpdateBase
+
+import config
+
+# The engines used for reading from and writing to a database (which may be
+# the same engine)
+Engines = namedtuple('Engines', ['reader', 'writer'])
+
+# Engines already created, by URL (so the modules sharing a database in one
+# process also share its connections)
+_engines = {}
+
+
+def tune_sqlite(engine):
+    """Applies the configured pragmas to each connection the engine opens."""
+
+    @event.listens_for(engine, 'connect')
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute(
+            'PRAGMA journal_mode={}'.format(config.SQLITE_JOURNAL_MODE))
+        cursor.execute(
+            'PRAGMA synchronous={}'.format(config.SQLITE_SYNCHRONOUS))
+        cursor.execute(
+            'PRAGMA cache_size=-{:d}'.format(config.SQLITE_CACHE_SIZE))
+        cursor.execute('PRAGMA mmap_size={:d}'.format(config.SQLITE_MMAP_SIZE))
+        cursor.execute(
+            'PRAGMA busy_timeout={:d}'.format(config.SQLITE_BUSY_TIMEOUT))
+        cursor.close()
+
+
+def create_engines(url):
+    """Creates the reader and writer engines for a database URL. Both are
+    tuned SQLite engines sharing the database file, unless the database
+    isn't a SQLite file (or a single writer is disabled), in which case the
+    same pooled engine is used for both."""
+    url = make_url(url)
+    is_sqlite = url.get_backend_name() == 'sqlite'
+    connect_args = {'check_same_thread': False} if is_sqlite else {}
+
+    # Connect through a connection pool that can be shared by several threads
+    reader = create_engine(
+        url,
+        poolclass=QueuePool,
+        pool_size=config.DB_POOL_SIZE,
+        max_overflow=config.DB_MAX_OVERFLOW,
+        pool_timeout=config.DB_POOL_TIMEOUT,
+        pool_recycle=config.DB_POOL_RECYCLE,
+        pool_pre_ping=config.DB_POOL_PRE_PING,
+        connect_args=connect_args)
+    if not is_sqlite:
+        return Engines(reader, reader)
+    tune_sqlite(reader)
+
+    # An in-memory database can't be shared between connections
+    if not config.DB_SINGLE_WRITER or url.database in (None, '', ':memory:'):
+        return Engines(reader, reader)
+
+    # Hold writers to one connection (waiting up to DB_POOL_TIMEOUT seconds
+    # for it)
+    writer = create_engine(
+        url,
+        poolclass=QueuePool,
+        pool_size=1,
+        max_overflow=0,
+        pool_timeout=config.DB_POOL_TIMEOUT,
+        pool_recycle=config.DB_POOL_RECYCLE,
+        pool_pre_ping=config.DB_POOL_PRE_PING,
+        connect_args=connect_args)
+    tune_sqlite(writer)
+    return Engines(reader, writer)
+
+
+def get_engines(url=None):
+    """Returns the engines for a database URL (by default, the configured
+    DATABASE_URL), creating them on first use."""
+    if url is None:
+        url = config.DATABASE_URL
+    if url not in _engines:
+        _engines[url] = create_engines(url)
+    return _engines[url]
+
+
+class RoutingSession(Session):
+    """A session that reads through the reader engine and writes through the
+    writer engine. Once a transaction has written anything, the rest of it
+    (reads included) uses the writer, so it sees its own changes. Writes
+    are flushes (see start_writing below) and UPDATE, INSERT, and DELETE
+    statements run through the session."""
+
+    def __init__(self, reader=None, writer=None, **kwargs):
+        super().__init__(**kwargs)
+        self.reader = reader
+        self.writer = writer
+        self._writing = False
+
+    def get_bind(self, mapper=None, clause=None, **kwargs):
+        if self.reader is None:
+            return super().get_bind(mapper=mapper, clause=clause, **kwargs)
+        if isinstance(clause, UpdateBase):
+            self._writing = True
+        return self.writer if self._writing else self.reader
+
+
+# Write through the writer from the start of a flush (before_flush is only
+# emitted when there are changes to flush)
+@event.listens_for(RoutingSession, 'before_flush')
+def start_writing(session, flush_context, instances):
+    session._writing = True
+
+
+# Go back to reading through the reader once a transaction has ended
+@event.listens_for(RoutingSession, 'after_transaction_end')
+def stop_writing(session, transaction):
+    if transaction.parent is None:
+        session._writing = False
+
+
+def create_session_factory(engines):
+    """Returns a session factory that routes reads and writes between the
+    supplied engines."""
+    return sessionmaker(
+        class_=RoutingSession, reader=engines.reader, writer=engines.writer)
@@ -0,0 +1,227 @@
+# Tests for the local verification of Google ID tokens (google_id_token.py).
+# Tokens are signed with an RSA key generated for the tests, whose public half
+# is served by a stand-in for Google's key set endpoint. Run them with:
+#
+#     python -m unittest test_google_id_token
+
+import base64
+import json
+import time
+import unittest
+
+import rsa
+
+from google_id_token import (
+    GoogleKeySet, IDTokenError, MIN_REFRESH_INTERVAL, verify_id_token)
+
+CLIENT_ID = 'client-id.apps.googleusercontent.com'
+KEY_ID = 'test-key'
+
+# Generating RSA keys is slow, so the tests share a pair of them
+PUBLIC_KEY, PRIVATE_KEY = rsa.newkeys(1024)
+OTHER_PUBLIC_KEY, OTHER_PRIVATE_KEY = rsa.newkeys(1024)
+
+
+def _b64encode(data):
+    """Encodes bytes as a base64url string without padding."""
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode('ascii')
+
+
+def _b64int(number):
+    """Encodes an integer as a big-endian base64url string."""
+    return _b64encode(number.to_bytes((number.bit_length() + 7) // 8, 'big'))
+
+
+def make_jwks(key_id=KEY_ID, public_key=PUBLIC_KEY):
+    """Returns a JSON Web Key Set holding a single public key."""
+    return {'keys': [{
+        'kty': 'RSA', 'alg': 'RS256', 'use': 'sig', 'kid': key_id,
+        'n': _b64int(public_key.n), 'e': _b64int(public_key.e)}]}
+
+
+def make_claims(**overrides):
+    """Returns the claims of a valid ID token, with any supplied changes (a
+    claim given as None is left out)."""
+    now = int(time.time())
+    claims = {
+        'iss': 'https://accounts.google.com',
+        'aud': CLIENT_ID,
+        'sub': '1234567890',
+        'email': 'noodles@example.com',
+        'email_verified': True,
+        'iat': now,
+        'exp': now + 3600}
+    claims.update(overrides)
+    return {name: value for name, value in claims.items()
+            if value is not None}
+
+
+def make_token(claims=None, key_id=KEY_ID, alg='RS256',
+               private_key=PRIVATE_KEY):
+    """Returns an ID token holding the supplied claims, signed with SHA-256
+    by the supplied private key."""
+    header = {'alg': alg, 'kid': key_id, 'typ': 'JWT'}
+    signed = '{}.{}'.format(
+        _b64encode(json.dumps(header).encode('utf-8')),
+        _b64encode(json.dumps(claims or make_claims()).encode('utf-8')))
+    signature = rsa.sign(signed.encode('ascii'), private_key, 'SHA-256')
+    return '{}.{}'.format(signed, _b64encode(signature))
+
+
+class FakeResponse(object):
+    """A response from the stand-in key set endpoint."""
+
+    def __init__(self, status_code, body, max_age):
+        self.status_code = status_code
+        self.body = body
+        self.headers = {'Cache-Control': 'public, max-age={}'.format(max_age)}
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise IOError('{} error'.format(self.status_code))
+
+    def json(self):
+        return self.body
+
+
+class FakeHTTP(object):
+    """A stand-in for the provider HTTP client, serving a key set."""
+
+    def __init__(self, jwks, max_age=3600):
+        self.jwks = jwks
+        self.max_age = max_age
+        self.status_code = 200
+        self.requests = 0
+
+    def get(self, url, params=None):
+        self.requests += 1
+        return FakeResponse(self.status_code, self.jwks, self.max_age)
+
+
+class VerifyIDTokenTest(unittest.TestCase):
+    """Tests for verify_id_token."""
+
+    def setUp(self):
+        self.http = FakeHTTP(make_jwks())
+        self.key_set = GoogleKeySet(self.http, lambda: 'https://keys')
+
+    def verify(self, token):
+        return verify_id_token(token, CLIENT_ID, self.key_set)
+
+    def test_valid_token(self):
+        claims = self.verify(make_token())
+        self.assertEqual(claims['sub'], '1234567890')
+        self.assertEqual(self.http.requests, 1)
+
+    def test_string_email_verified(self):
+        self.verify(make_token(make_claims(email_verified='true')))
+
+    def test_bad_signature(self):
+        token = make_token(private_key=OTHER_PRIVATE_KEY)
+        with self.assertRaisesRegex(IDTokenError, 'Invalid signature'):
+            self.verify(token)
+
+    def test_tampered_claims(self):
+        header, _, signature = make_token().split('.')
+        claims = _b64encode(json.dumps(
+            make_claims(sub='0987654321')).encode('utf-8'))
+        with self.assertRaisesRegex(IDTokenError, 'Invalid signature'):
+            self.verify('.'.join([header, claims, signature]))
+
+    def test_wrong_audience(self):
+        token = make_token(make_claims(aud='someone-else'))
+        with self.assertRaisesRegex(IDTokenError, 'Client ID mismatch'):
+            self.verify(token)
+
+    def test_wrong_issuer(self):
+        token = make_token(make_claims(iss='https://accounts.example.com'))
+        with self.assertRaisesRegex(IDTokenError, 'Unexpected issuer'):
+            self.verify(token)
+
+    def test_expired_token(self):
+        now = int(time.time())
+        token = make_token(make_claims(iat=now - 7200, exp=now - 3600))
+        with self.assertRaisesRegex(IDTokenError, 'Token expired'):
+            self.verify(token)
+
+    def test_token_used_too_early(self):
+        now = int(time.time())
+        token = make_token(make_claims(iat=now + 3600, exp=now + 7200))
+        with self.assertRaisesRegex(IDTokenError, 'Token used too early'):
+            self.verify(token)
+
+    def test_unverified_email(self):
+        for email_verified in (False, 'false', None):
+            token = make_token(make_claims(email_verified=email_verified))
+            with self.assertRaisesRegex(
+                    IDTokenError, 'Email address not verified'):
+                self.verify(token)
+
+    def test_unknown_key(self):
+        token = make_token(key_id='other-key', private_key=OTHER_PRIVATE_KEY)
+        with self.assertRaisesRegex(IDTokenError, 'Unknown signing key'):
+            self.verify(token)
+
+    def test_unexpected_algorithm(self):
+        for alg in ('HS256', 'none', 'RS512'):
+            token = make_token(alg=alg)
+            with self.assertRaisesRegex(IDTokenError, 'Unexpected algorithm'):
+                self.verify(token)
+
+    def test_malformed_token(self):
+        for token in ('', 'a.b', 'a.b.c', None):
+            with self.assertRaisesRegex(IDTokenError, 'Malformed ID token'):
+                self.verify(token)
+
+
+class GoogleKeySetTest(unittest.TestCase):
+    """Tests for the caching of Google's signing keys."""
+
+    def setUp(self):
+        self.http = FakeHTTP(make_jwks())
+        self.key_set = GoogleKeySet(self.http, lambda: 'https://keys')
+
+    def expire(self):
+        """Makes the cached keys expire, and allows an early refetch."""
+        self.key_set._expires = 0
+        self.key_set._fetched_at -= MIN_REFRESH_INTERVAL
+
+    def test_keys_cached(self):
+        self.key_set.get_key(KEY_ID)
+        self.key_set.get_key(KEY_ID)
+        self.assertEqual(self.http.requests, 1)
+
+    def test_keys_fetched_when_expired(self):
+        self.key_set.get_key(KEY_ID)
+        self.expire()
+        self.key_set.get_key(KEY_ID)
+        self.assertEqual(self.http.requests, 2)
+
+    def test_unknown_key_refetch_limited(self):
+        self.key_set.get_key(KEY_ID)
+        for _ in range(3):
+            with self.assertRaises(IDTokenError):
+                self.key_set.get_key('other-key')
+        self.assertEqual(self.http.requests, 1)
+
+    def test_rotated_key_fetched(self):
+        self.key_set.get_key(KEY_ID)
+        self.key_set._fetched_at -= MIN_REFRESH_INTERVAL
+        self.http.jwks = make_jwks('new-key', OTHER_PUBLIC_KEY)
+        self.assertEqual(self.key_set.get_key('new-key'), OTHER_PUBLIC_KEY)
+
+    def test_old_keys_kept_on_failed_fetch(self):
+        self.key_set.get_key(KEY_ID)
+        self.expire()
+        self.http.status_code = 503
+        self.http.jwks = {'error': 'unavailable'}
+        self.assertEqual(self.key_set.get_key(KEY_ID), PUBLIC_KEY)
+
+    def test_failed_first_fetch(self):
+        self.http.status_code = 500
+        with self.assertRaisesRegex(IDTokenError, 'Failed to fetch'):
+            self.key_set.get_key(KEY_ID)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,88 @@
+# Tests that the listing pages (the home page, a category's page, and "My
+# noodles") run the same number of SQL statements however many items the
+# catalog holds. Each page is rendered against a small and a large catalog of
+# synthetic items. Run them with:
+#
+#     python -m unittest test_listing_queries
+
+import os
+import shutil
+import tempfile
+import unittest
+
+# Point the app at a throwaway database, and have it render every page (rather
+# than serving cached pages or snapshots), before it's imported
+DIRECTORY = tempfile.mkdtemp()
+os.environ['CATALOG_DATABASE_URL'] = 'sqlite:///{}'.format(
+    os.path.join(DIRECTORY, 'catalog.db'))
+os.environ['CATALOG_PAGE_CACHE_BACKEND'] = 'none'
+os.environ['CATALOG_SNAPSHOT_DIR'] = ''
+
+import app
+from benchmark import build_database, dispose, sqlite_url, use_database
+from query_counter import QueryCounter, assert_query_count
+
+# Sizes of the small and large catalogs, as (categories, items)
+SMALL_CATALOG = (2, 10)
+LARGE_CATALOG = (20, 2000)
+
+# The listing pages, by view
+URLS = {
+    'index': '/',
+    'show_category': '/catalog/category1',
+    'show_user_items': '/my-noodles'}
+
+
+def tearDownModule():
+    shutil.rmtree(DIRECTORY, ignore_errors=True)
+
+
+class ListingQueriesTest(unittest.TestCase):
+    """Tests that the listing pages run a constant number of statements."""
+
+    def setUp(self):
+        # Log in as the owner of the synthetic items (so "My noodles" lists
+        # them, and the pages are rendered for a logged in user)
+        app.app.secret_key = 'test'
+        self.client = app.app.test_client()
+        with self.client.session_transaction() as login_session:
+            login_session['username'] = 'Bench User'
+            login_session['user_id'] = 1
+
+    def get(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200, url)
+        return response
+
+    def use_catalog(self, size, name):
+        """Builds a catalog of the supplied size, and points the app at it."""
+        num_categories, num_items = size
+        engines = build_database(
+            sqlite_url(DIRECTORY, name), num_categories, num_items)
+        use_database(engines)
+        self.addCleanup(dispose, engines)
+        self.addCleanup(app.session.remove)
+        return engines
+
+    def test_constant_query_counts(self):
+        # Count each page's statements on the small catalog (once the
+        # category cache has been filled)
+        engines = self.use_catalog(SMALL_CATALOG, 'small.db')
+        counts = {}
+        for view, url in URLS.items():
+            self.get(url)
+            with QueryCounter(*engines) as counter:
+                self.get(url)
+            counts[view] = counter.count
+
+        # The same pages must run as many on a catalog 200 times larger
+        engines = self.use_catalog(LARGE_CATALOG, 'large.db')
+        for view, url in URLS.items():
+            self.get(url)
+            with self.subTest(view=view):
+                with assert_query_count(*engines, expected=counts[view]):
+                    self.get(url)
+
+
+if __name__ == '__main__':
+    unittest.main()